@@ -7,17 +7,26 @@ import gzip
 import sys
 import os
 import random
+import itertools
 
+from .fastq_index import open_shard
+from .bgzf_writer import ParallelBgzfWriter, BLOCK_SIZE
+from mgha_common.memory import MemoryBudget
 
-def count_fastq(file_path):
+
+def count_fastq(file_path, shard=None):
     """
     Read in FastQ entries from a single FastQ file and 
     output the number of reads and the total sequence length. 
+    If `shard` = (i, N) is given, only count the reads in 
+    the i-th of N shards (see `fastq_index.py`). 
     """
     count = 0
     total_len = 0
-    with open_handler(file_path) as file:
-        for fastQid, seq, qual in seq_io.QualityIO.FastqGeneralIterator(file):
+    file, n_reads = shard_handler(file_path, shard)
+    with file:
+        reads = seq_io.QualityIO.FastqGeneralIterator(file)
+        for fastQid, seq, qual in itertools.islice(reads, n_reads):
             count += 1
             total_len += len(seq)
     return (count, total_len)
@@ -44,6 +53,35 @@ def open_handler(file_path, filemode='rt'):
     else:
         return open(file_path, filemode)
 
+def shard_handler(file_path, shard=None):
+    """
+    Return (file handle, number of reads to process). 
+    Without a shard the whole file is read and the 
+    number of reads is None, which `itertools.islice` 
+    treats as unbounded. 
+    """
+    if shard is None:
+        return open_handler(file_path), None
+    return open_shard(file_path, shard)
+
+def outfile_handler(file_path, compression=None, filemode='wt', threads=1, gzi=False):
+    """
+    Return a file handle in write mode. 
+    Valid compression mode: 
+        compression = None | "gzip" | "gz" | "bgzip" | "bgz"
+    With compression = None the handle is chosen from the file 
+    extension as in `open_handler`. BGZF output is compressed 
+    by `threads` workers and optionally indexed (`.gzi`). 
+    """
+    if compression is None:
+        return open_handler(file_path, filemode)
+    elif compression.lower() in ["gzip", "gz"]:
+        return gzip.open(file_path, filemode)
+    elif compression.lower() in ["bgzip", "bgz"]:
+        return ParallelBgzfWriter(file_path, threads=threads, gzi=gzi)
+    else:
+        raise RuntimeError("`compression = %s` invalid." % str(compression))
+
 
 #########################
 # Anonymising single input id
@@ -153,21 +191,37 @@ def anonymise_fastq(file_path, fmt, retained_fields=[], out_sep=':'):
 
 ## Streaming both input and output
 
-def anonymise_process(infilepath, outfilepath, fmt, retained_fields=[], out_sep=':', outfilemode='wt'):
+def anonymise_process(infilepath, outfilepath, fmt, retained_fields=[], out_sep=':', outfilemode='wt', shard=None,
+                      outfile_compress=None, threads=1, gzi=False, max_memory=None):
     """
     Stream from input fastq to output fastq. 
-    #!!! Change to using zipfile output writer bgzf!!
+    If `shard` = (i, N) is given, only the reads in the 
+    i-th of N shards of the input are anonymised. 
+    See `outfile_handler` for `outfile_compress`, `threads` and `gzi`. 
+    Reads are streamed one at a time. With `max_memory` (in bytes), 
+    the number of BGZF compression workers is capped to fit 
+    in the limit and a warning is issued if it was exceeded. 
     """
-    with open_handler(infilepath) as infile:
-        with open_handler(outfilepath, filemode=outfilemode) as outfile:
+    budget = None
+    if max_memory:
+        budget = MemoryBudget(max_memory)
+        # each worker has up to 4 blocks in flight, compressed and uncompressed
+        threads = budget.pool_width(threads, per_worker=4 * 2 * BLOCK_SIZE)
+
+    infile, n_reads = shard_handler(infilepath, shard)
+    with infile:
+        with outfile_handler(outfilepath, outfile_compress, filemode=outfilemode,
+                             threads=threads, gzi=gzi) as outfile:
             count = 0
-            reads = seq_io.parse(infile, "fastq")
+            reads = itertools.islice(seq_io.parse(infile, "fastq"), n_reads)
             for read in reads:
                 anon = anonymise_id(read.id, fmt, retained_fields, out_sep)
                 read.id = anon
                 read.name = anon
                 seq_io.write(read, outfile, "fastq")
                 count += 1
+    if budget is not None:
+        budget.check("anonymise_fastq")
     return count
 
 
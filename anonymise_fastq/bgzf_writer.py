@@ -0,0 +1,137 @@
+"""
+Parallel BGZF writer.
+
+BGZF files are a series of independent gzip members ("blocks") each
+holding at most 64 KB of uncompressed data, see section 4.1 of the SAM
+specification. Since the blocks are independent we can compress them in a
+pool of workers and only need to write them out in order.
+
+`zlib` releases the GIL while compressing, so a thread pool is enough to
+keep several cores busy.
+
+Optionally a `.gzi` index (as produced by `bgzip --index`) is written on
+close, giving downstream tools random access into the compressed output.
+"""
+
+import collections
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Same limit as htslib so that incompressible data still fits in one block.
+BLOCK_SIZE = 0xff00
+
+# gzip magic, deflate, FEXTRA, mtime, xfl, OS, XLEN=6, 'BC' subfield of length 2
+_BLOCK_HEADER = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00"
+_EOF_BLOCK = (b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43"
+              b"\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00")
+
+
+def compress_block(data, compresslevel=6):
+    """
+    Compress `data` (at most `BLOCK_SIZE` bytes)
+    into a single BGZF block.
+    """
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    compressed = compressor.compress(data) + compressor.flush()
+    return b"".join([
+        _BLOCK_HEADER,
+        struct.pack("<H", len(compressed) + 25),
+        compressed,
+        struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data)),
+        ])
+
+
+def write_gzi(gzi_path, entries):
+    """
+    Write a bgzip `.gzi` index: the number of entries followed by
+    (compressed offset, uncompressed offset) pairs of every block
+    except the first, all as little-endian uint64.
+    """
+    with open(gzi_path, 'wb') as outfile:
+        outfile.write(struct.pack("<Q", len(entries)))
+        for compressed_offset, uncompressed_offset in entries:
+            outfile.write(struct.pack("<QQ", compressed_offset, uncompressed_offset))
+
+
+class ParallelBgzfWriter(object):
+    """
+    Text mode, write-only file handle producing a BGZF file.
+
+    Parameters:
+    -----------
+    filepath :: String
+      - path of the output file.
+    threads :: Int
+      - number of compression workers.
+    gzi :: Bool
+      - if True, write the index to `filepath + '.gzi'` on close.
+    compresslevel :: Int
+      - zlib compression level.
+    """
+    def __init__(self, filepath, threads=1, gzi=False, compresslevel=6):
+        self.filepath = filepath
+        self.compresslevel = compresslevel
+        self.gzi_path = filepath + ".gzi" if gzi else None
+        self._handle = open(filepath, 'wb')
+        self._pool = ThreadPoolExecutor(max_workers=max(1, threads))
+        # bound the number of blocks held in memory
+        self._max_pending = 4 * max(1, threads)
+        self._pending = collections.deque()
+        self._buffer = bytearray()
+        self._compressed_offset = 0
+        self._uncompressed_offset = 0
+        self._gzi_entries = []
+        self.closed = False
+
+    def write(self, text):
+        self._buffer += text.encode("utf-8")
+        while len(self._buffer) >= BLOCK_SIZE:
+            self._submit(bytes(self._buffer[:BLOCK_SIZE]))
+            del self._buffer[:BLOCK_SIZE]
+        return len(text)
+
+    def _submit(self, data):
+        if len(self._pending) >= self._max_pending:
+            self._write_next()
+        future = self._pool.submit(compress_block, data, self.compresslevel)
+        self._pending.append((future, len(data)))
+
+    def _write_next(self):
+        future, n_uncompressed = self._pending.popleft()
+        block = future.result()
+        if self._compressed_offset > 0:
+            self._gzi_entries.append((self._compressed_offset, self._uncompressed_offset))
+        self._handle.write(block)
+        self._compressed_offset += len(block)
+        self._uncompressed_offset += n_uncompressed
+
+    def flush(self):
+        """
+        Compress whatever is buffered as a (possibly short)
+        block and write all outstanding blocks.
+        """
+        if self._buffer:
+            self._submit(bytes(self._buffer))
+            self._buffer = bytearray()
+        while self._pending:
+            self._write_next()
+        self._handle.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self._pool.shutdown()
+        self._handle.write(_EOF_BLOCK)
+        self._handle.close()
+        if self.gzi_path is not None:
+            write_gzi(self.gzi_path, self._gzi_entries)
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,305 @@
+"""
+Record-offset index for FastQ files.
+
+The index records the offset of the start of every K-th read in a
+compact binary sidecar file (`<fastq>.fqi`). For a plain FastQ file the
+offsets are byte offsets, for a BGZF compressed FastQ file they are BGZF
+virtual offsets. Having these offsets allow us to jump directly to read N
+and therefore split a single FastQ file into shards that can be processed
+independently (e.g. on different cluster nodes) without first splitting
+the file on disk.
+
+Only the standard 4-lines-per-record FastQ layout is supported.
+Ordinary (non-BGZF) gzip files cannot be indexed since they do not
+support random access.
+"""
+
+import argparse
+import collections
+import io
+import mmap
+import os
+import struct
+from array import array
+
+import Bio.bgzf as bgzf
+
+from mgha_common.arguments import positive_int
+
+
+INDEX_EXTENSION = ".fqi"
+INDEX_MAGIC = b"FQI\x01"
+DEFAULT_EVERY = 100000
+
+PLAIN = 0
+BGZF = 1
+
+# magic, kind, every, number of reads, number of offsets
+_HEADER = struct.Struct("<4sBQQQ")
+
+FastqIndex = collections.namedtuple("FastqIndex", ["kind", "every", "n_records", "offsets"])
+
+
+def is_bgzf(file_path):
+    """
+    Detect if the file is BGZF compressed by checking
+    for the gzip magic numbers followed by the 'BC'
+    extra subfield that every BGZF block carries.
+    See the SAM specification, section 4.1.
+    """
+    with open(file_path, 'rb') as infile:
+        header = infile.read(18)
+    return (len(header) == 18
+            and header[:4] == b"\x1f\x8b\x08\x04"
+            and header[12:14] == b"BC")
+
+
+def is_gzipped(file_path):
+    with open(file_path, 'rb') as infile:
+        return infile.read(2) == b"\x1f\x8b"
+
+
+#########################
+# Building the index
+#########################
+
+def build_fastq_index(file_path, every=DEFAULT_EVERY):
+    """
+    Scan the FastQ file at `file_path` and record
+    the offset of the first read and every `every`-th
+    read after that.
+
+    Returns a `FastqIndex` named tuple.
+    """
+    if every < 1:
+        raise RuntimeError("Index interval must be a positive integer, got %i" % every)
+    if is_bgzf(file_path):
+        n_records, offsets = _scan_bgzf(file_path, every)
+        kind = BGZF
+    elif is_gzipped(file_path):
+        raise RuntimeError("Cannot index %s: only plain or BGZF compressed "
+                           "FastQ files support random access." % file_path)
+    else:
+        n_records, offsets = _scan_plain(file_path, every)
+        kind = PLAIN
+    return FastqIndex(kind, every, n_records, offsets)
+
+
+def _scan_plain(file_path, every):
+    """
+    Memory map the file and count the newlines in large
+    blocks, only locating the start of every `every`-th read.
+    Blank lines are allowed before the first and after the last read.
+    """
+    offsets = array('Q')
+    if os.path.getsize(file_path) == 0:
+        return 0, offsets
+
+    with open(file_path, 'rb') as infile, \
+            mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        end = mm.size()
+        while start < end and mm[start] == 10:
+            start += 1
+        # `end` is then just after the last character of the last line
+        while end > start and mm[end - 1] == 10:
+            end -= 1
+        n_lines = 0
+        pos = start
+        while pos < end:
+            if mm[pos] != 64: # '@'
+                raise RuntimeError("Read %i at byte offset %i of %s does not start with '@'"
+                                   % (n_lines // 4, pos, file_path))
+            offsets.append(pos)
+            # count blocks about the size of `every` reads seen so far
+            block = _SCAN_BLOCK
+            if n_lines:
+                block = min(block, max(_FIND_LINES, (pos - start) * 4 * every // n_lines))
+            pos, n_skipped = _skip_lines(mm, pos, end, 4 * every, block)
+            n_lines += n_skipped
+    if n_lines % 4 != 0:
+        raise RuntimeError("%s has %i lines, which is not a multiple of 4."
+                           % (file_path, n_lines))
+    return n_lines // 4, offsets
+
+
+# Largest block of the memory map whose newlines are counted at once.
+_SCAN_BLOCK = 2 ** 20
+# Below this many lines, newlines are located one by one instead.
+_FIND_LINES = 64
+
+
+def _skip_lines(mm, pos, end, n_lines, block=_SCAN_BLOCK):
+    """
+    Skip `n_lines` lines of `mm` starting at `pos`, counting newlines
+    in blocks of at most `block` bytes. Returns the offset after the last
+    newline skipped and `n_lines`, or `end` and the number of lines
+    from `pos` to `end` if there are fewer lines.
+    """
+    n_skipped = 0
+    while n_lines - n_skipped > _FIND_LINES:
+        block_end = min(pos + block, end)
+        n_newlines = mm[pos:block_end].count(b"\n")
+        if n_skipped + n_newlines >= n_lines:
+            # too far, count a smaller block
+            block //= 2
+            continue
+        n_skipped += n_newlines
+        pos = block_end
+        if pos == end:
+            # the last line has no newline within `end`
+            return end, n_skipped + 1
+    for _ in range(n_lines - n_skipped):
+        newline = mm.find(b"\n", pos, end)
+        if newline == -1:
+            return end, n_skipped + 1
+        pos = newline + 1
+        n_skipped += 1
+    return pos, n_skipped
+
+
+def _scan_bgzf(file_path, every):
+    """
+    Read the BGZF file line by line, recording
+    the virtual offset before each indexed read.
+    """
+    offsets = array('Q')
+    n_records = 0
+    with bgzf.BgzfReader(file_path, 'rb') as infile:
+        while True:
+            offset = infile.tell()
+            line = infile.readline()
+            if not line:
+                break
+            if line == b"\n":
+                continue
+            if not line.startswith(b"@"):
+                raise RuntimeError("Read %i at virtual offset %i of %s does not start with '@'"
+                                   % (n_records, offset, file_path))
+            if n_records % every == 0:
+                offsets.append(offset)
+            for _ in range(3):
+                infile.readline()
+            n_records += 1
+    return n_records, offsets
+
+
+#########################
+# Reading and writing the sidecar file
+#########################
+
+def index_path_for(file_path):
+    return file_path + INDEX_EXTENSION
+
+
+def write_fastq_index(index, index_path):
+    """
+    Write `index` to `index_path`. The file is written to
+    a temporary name first and moved into place so that
+    concurrent readers never see a partial index.
+    """
+    offsets = array('Q', index.offsets)
+    tmp_path = "%s.%i.tmp" % (index_path, os.getpid())
+    with open(tmp_path, 'wb') as outfile:
+        outfile.write(_HEADER.pack(INDEX_MAGIC, index.kind, index.every,
+                                   index.n_records, len(offsets)))
+        outfile.write(offsets.tobytes())
+    os.replace(tmp_path, index_path)
+
+
+def read_fastq_index(index_path):
+    with open(index_path, 'rb') as infile:
+        magic, kind, every, n_records, n_offsets = _HEADER.unpack(infile.read(_HEADER.size))
+        if magic != INDEX_MAGIC:
+            raise RuntimeError("%s is not a FastQ index file." % index_path)
+        offsets = array('Q')
+        offsets.frombytes(infile.read(n_offsets * offsets.itemsize))
+    if len(offsets) != n_offsets:
+        raise RuntimeError("FastQ index file %s is truncated." % index_path)
+    return FastqIndex(kind, every, n_records, offsets)
+
+
+def load_fastq_index(file_path, every=None, index_path=None):
+    """
+    Load the sidecar index of `file_path` if it exists, is newer
+    than the FastQ file and records every `every`-th read
+    (any interval if `every` is None), otherwise build it
+    and save it next to the FastQ file.
+    """
+    if index_path is None:
+        index_path = index_path_for(file_path)
+    if (os.path.isfile(index_path)
+            and os.path.getmtime(index_path) >= os.path.getmtime(file_path)):
+        index = read_fastq_index(index_path)
+        if every is None or index.every == every:
+            return index
+    index = build_fastq_index(file_path, every or DEFAULT_EVERY)
+    write_fastq_index(index, index_path)
+    return index
+
+
+#########################
+# Sharding
+#########################
+
+def shard_bounds(index, shard, n_shards):
+    """
+    Split the indexed reads into `n_shards` contiguous ranges
+    that start on indexed reads and return the
+    (offset, number of reads) of the `shard`-th range.
+    Shards can be empty if there are fewer indexed
+    reads than shards.
+    """
+    n_offsets = len(index.offsets)
+    first = (shard - 1) * n_offsets // n_shards
+    last = shard * n_offsets // n_shards
+    if first == last:
+        return None, 0
+    start_read = first * index.every
+    end_read = min(last * index.every, index.n_records)
+    return index.offsets[first], end_read - start_read
+
+
+def open_shard(file_path, shard, index=None):
+    """
+    Open `file_path` in text mode positioned at the start
+    of `shard` = (i, N). Returns the tuple (file handle, number of reads
+    in the shard). The caller should stop after that many reads.
+    """
+    if index is None:
+        index = load_fastq_index(file_path)
+    offset, n_reads = shard_bounds(index, *shard)
+    if index.kind == BGZF:
+        handle = bgzf.BgzfReader(file_path, 'rt')
+    else:
+        handle = io.TextIOWrapper(open(file_path, 'rb'))
+    if offset is not None:
+        handle.seek(offset)
+    return handle, n_reads
+
+
+#############################################################################
+# Commandline argument parser and main function
+#############################################################################
+
+def main():
+    parser = argparse.ArgumentParser(
+            description="Build a record-offset index (%s) for a FastQ file." % INDEX_EXTENSION)
+    parser.add_argument("--infilepath", metavar="FILENAME",
+                        type=str,
+                        required=True,
+                        help="File path to the input `.fastq` or BGZF compressed `.fastq.gz` file.")
+    parser.add_argument("--every", metavar="K",
+                        type=positive_int,
+                        default=DEFAULT_EVERY,
+                        help="Record the offset of every K-th read. "
+                             "Default: %i" % DEFAULT_EVERY)
+    user_inputs = parser.parse_args()
+    index = build_fastq_index(user_inputs.infilepath, user_inputs.every)
+    write_fastq_index(index, index_path_for(user_inputs.infilepath))
+    print("Indexed %i reads (%i offsets)." % (index.n_records, len(index.offsets)))
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,10 @@ import logging
 import sys
 import argparse
 
-from anonymise import anonymise_process
+from mgha_common.client import submit_job
+from mgha_common.memory import parse_memory
+from mgha_common.shard import parse_shard
+from mgha_common.arguments import positive_int
 
 
 # Uncomment for memory_profiler to work on this script
@@ -19,15 +22,54 @@ def main():
 	Main
 	"""
 	parser = argparser()
-	user_inputs = parser.parse_args()
-	anonymise_process(user_inputs.infilepath, 
+	user_inputs = parse_inputs(parser)
+	if user_inputs.server:
+		# thin client: let a running job server do the work
+		submit_job(user_inputs.server, "anonymise_fastq", sys.argv[1:])
+		return 0
+	run(user_inputs)
+	return 0
+
+
+def run(user_inputs):
+	"""
+	Anonymise the input file according to the parsed 
+	commandline arguments `user_inputs`. 
+	Returns the number of reads written. 
+	The anonymising modules are only imported here, so that 
+	submitting a job with `--server` stays fast. 
+	"""
+	from .anonymise import anonymise_process
+	from .fastq_index import load_fastq_index
+
+	if user_inputs.shard is not None:
+		# build (or load) the record-offset index before streaming the shard
+		load_fastq_index(user_inputs.infilepath, every=user_inputs.index_every)
+	return anonymise_process(user_inputs.infilepath, 
 		              user_inputs.outfilepath, 
     	              fmt=user_inputs.idformat, 
     	              retained_fields=user_inputs.retained_fields,
     	              out_sep=':',
-    	              outfilemode='wt')
-	return 0
+    	              outfilemode='wt',
+    	              shard=user_inputs.shard,
+    	              outfile_compress=user_inputs.outfile_compress,
+    	              threads=user_inputs.threads,
+    	              gzi=user_inputs.gzi,
+    	              max_memory=user_inputs.max_memory)
+
 
+def parse_inputs(parser, args=None):
+	"""
+	Parse the commandline arguments `args` (default: sys.argv) with `parser` 
+	and check the combinations of options that argparse cannot check by itself. 
+	"""
+	user_inputs = parser.parse_args(args)
+	bgzip = user_inputs.outfile_compress in ["bgzip", "bgz"]
+	if user_inputs.gzi and not bgzip:
+		parser.error("--gzi requires --outfile_compress bgzip.")
+	if user_inputs.threads != 1 and not bgzip:
+		parser.error("--threads requires --outfile_compress bgzip.")
+	return user_inputs
 
 
 def argparser():
@@ -59,6 +101,47 @@ def argparser():
     	                help="A list of field names as specified in the ID format string "
     	                     "for which the anonymising process would retain. "
     	                     "Default: Empty")
+    parser.add_argument("--shard", metavar="i/N",
+                        type=parse_shard,
+                        default=None,
+                        help="Only process the i-th of N shards of the input file (1 <= i <= N). "
+                             "Requires a plain or BGZF compressed input. "
+                             "A record-offset index `<infilepath>.fqi` is built if not present. "
+                             "Default: process the whole file")
+    parser.add_argument("--index_every", metavar="K",
+                        type=positive_int,
+                        default=100000,
+                        help="When building the record-offset index, "
+                             "record the offset of every K-th read. "
+                             "Default: 100000")
+    parser.add_argument("--outfile_compress", metavar="MODE",
+                        type=str,
+                        choices=["gzip", "gz", "bgzip", "bgz"],
+                        default=None,
+                        help="Compression of the output file: gzip or bgzip. "
+                             "Default: chosen from the output file extension "
+                             "(gzip for `.gz`, uncompressed otherwise)")
+    parser.add_argument("--threads", metavar="N",
+                        type=positive_int,
+                        default=1,
+                        help="Number of workers compressing BGZF blocks "
+                             "when `--outfile_compress bgzip`. Default: 1")
+    parser.add_argument("--gzi",
+                        action="store_true",
+                        help="Also write a `.gzi` index for BGZF output, "
+                             "as `bgzip --index` would.")
+    parser.add_argument("--max_memory", metavar="SIZE",
+                        type=parse_memory,
+                        default=None,
+                        help="Memory limit of the job, e.g. 2G. The number of BGZF "
+                             "compression workers is then limited to stay within the limit "
+                             "(reads are always streamed one at a time). Default: no limit")
+    parser.add_argument("--server", metavar="SOCKET",
+                        type=str,
+                        default=None,
+                        help="Submit the job to a running `mgha_job_server` "
+                             "listening on the Unix socket SOCKET "
+                             "instead of running it in this process.")
     return parser
 
 if __name__ == "__main__":
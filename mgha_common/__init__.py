@@ -0,0 +1,4 @@
+"""
+Utilities shared by the anonymise_fastq and vcf_features packages: 
+memory budgets, shard specifications, argument types and the job server client. 
+"""
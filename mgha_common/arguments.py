@@ -0,0 +1,18 @@
+"""
+argparse argument types shared by the commandline tools.
+"""
+
+import argparse
+
+
+def positive_int(string):
+    """
+    argparse type for integers >= 1.
+    """
+    try:
+        value = int(string)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Expected a positive integer, got '%s'" % string)
+    if value < 1:
+        raise argparse.ArgumentTypeError("Expected a positive integer, got '%s'" % string)
+    return value
@@ -0,0 +1,31 @@
+"""
+Client side of the local job server (see `vcf_features/server.py`).
+
+Only the standard library is imported here, so that the commandline
+tools can submit a job without paying for the analysis imports.
+"""
+
+import json
+import os
+import socket
+
+
+DEFAULT_SOCKET = "/tmp/mgha_job_server_%i.sock" % os.getuid()
+
+
+def submit_job(socket_path, job, args, cwd=None):
+    """
+    Send a job to the server listening on `socket_path`
+    and block until it is done. Relative paths in `args`
+    are resolved against `cwd` (default: current directory).
+    Returns the result of the job.
+    """
+    request = {"job": job, "args": list(args), "cwd": cwd or os.getcwd()}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        with sock.makefile('rb') as reply_file:
+            reply = json.loads(reply_file.readline())
+    if reply["status"] != "ok":
+        raise RuntimeError("Job server failed to run %s:\n%s" % (job, reply["message"]))
+    return reply.get("result")
@@ -0,0 +1,131 @@
+"""
+Memory budget for chunked processing.
+
+Given a hard memory limit (`--max_memory`), `MemoryBudget` chooses how
+many records to process at once from the measured size of the records and
+the resident set size (RSS) of the process, so that the same job fits in a
+small or a large memory slot:
+
+  - chunks grow while there is headroom (at most doubling per chunk),
+  - chunks shrink as the RSS gets close to the limit,
+  - the peak RSS is tracked and a warning is issued if it exceeds the limit.
+
+Only the standard library is used: the RSS is read from /proc on Linux
+and the peak from `resource.getrusage`.
+"""
+
+import argparse
+import resource
+import sys
+import warnings
+
+
+_UNITS = {"" : 1, "K" : 2 ** 10, "M" : 2 ** 20, "G" : 2 ** 30, "T" : 2 ** 40}
+
+
+def parse_memory(string):
+    """
+    Parse a memory size such as "512M", "2G" or "2GB"
+    (powers of 1024) or a plain number of bytes.
+    """
+    size = string.strip().upper()
+    if size.endswith("B"):
+        size = size[:-1]
+    unit = size[-1:] if size[-1:] in _UNITS else ""
+    try:
+        value = float(size[:len(size) - len(unit)])
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid memory size '%s', use e.g. 512M or 2G." % string)
+    if value <= 0:
+        raise argparse.ArgumentTypeError("Memory size must be positive, got '%s'." % string)
+    return int(value * _UNITS[unit])
+
+
+def peak_rss():
+    """
+    Peak resident set size of this process in bytes.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
+
+
+def current_rss():
+    """
+    Current resident set size of this process in bytes.
+    Falls back to the peak where /proc is not available.
+    """
+    try:
+        with open("/proc/self/statm", 'r') as infile:
+            return int(infile.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return peak_rss()
+
+
+class MemoryBudget(object):
+    """
+    Choose chunk sizes (in records) that keep this process below `limit` bytes.
+
+    Parameters:
+    -----------
+    limit :: Int
+      - memory limit in bytes.
+    minimum, maximum :: Int
+      - bounds on the number of records per chunk.
+    overhead :: Float
+      - how many times its own size a chunk takes up while
+        being processed (copies, intermediate columns, ...).
+    high_water :: Float
+      - fraction of `limit` the RSS should stay below.
+    """
+    def __init__(self, limit, minimum=1000, maximum=10 ** 7, overhead=4.0, high_water=0.8):
+        self.limit = limit
+        self.minimum = minimum
+        self.maximum = maximum
+        self.overhead = overhead
+        self.high_water = high_water
+        self.record_size = None
+        self.chunk_size = minimum
+        self.peak = current_rss()
+
+    def observe(self, n_records, n_bytes):
+        """
+        Record that a chunk of `n_records` records took `n_bytes` bytes.
+        The largest per record size seen so far is kept.
+        """
+        if n_records > 0:
+            size = float(n_bytes) / n_records
+            self.record_size = size if self.record_size is None else max(self.record_size, size)
+
+    def next_chunk_size(self):
+        """
+        Number of records to read for the next chunk.
+        """
+        rss = current_rss()
+        self.peak = max(self.peak, rss)
+        if self.record_size is None:
+            return self.chunk_size
+        headroom = self.high_water * self.limit - rss
+        fitting = int(headroom / (self.record_size * self.overhead))
+        size = min(fitting, 2 * self.chunk_size)
+        self.chunk_size = max(self.minimum, min(self.maximum, size))
+        return self.chunk_size
+
+    def pool_width(self, requested, per_worker, fraction=0.25):
+        """
+        Number of workers, at most `requested`, each holding
+        `per_worker` bytes, that fit in `fraction` of the limit.
+        """
+        return max(1, min(requested, int(fraction * self.limit / per_worker)))
+
+    def check(self, task="This job"):
+        """
+        Warn if the peak RSS exceeded the limit.
+        """
+        self.peak = max(self.peak, peak_rss())
+        if self.peak > self.limit:
+            warnings.warn("%s used %.0f MB at peak, more than the %.0f MB memory limit."
+                          % (task, self.peak / 2.0 ** 20, self.limit / 2.0 ** 20))
+        return self.peak
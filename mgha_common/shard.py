@@ -0,0 +1,20 @@
+"""
+Parsing of shard specifications shared by the commandline tools.
+"""
+
+import argparse
+
+
+def parse_shard(shard_string):
+    """
+    Parse a shard specification of the form "i/N",
+    meaning the i-th of N shards, with 1 <= i <= N.
+    Returns the tuple (i, N).
+    """
+    try:
+        shard, n_shards = [int(x) for x in shard_string.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError("Shard must be of the form i/N, got '%s'" % shard_string)
+    if not 1 <= shard <= n_shards:
+        raise argparse.ArgumentTypeError("Shard index must satisfy 1 <= i <= N, got '%s'" % shard_string)
+    return shard, n_shards
@@ -6,15 +6,17 @@ setup(name="MGHA_bioinformatics",
       version="0.2.0",
       author="Edmund Lau",
       author_email="edmundlth95@gmail.com",
-      packages=["anonymise_fastq", "vcf_features"],
+      packages=["anonymise_fastq", "vcf_features", "mgha_common"],
       package_dir={
         "anonymise_fastq" : "anonymise_fastq", 
-        "vcf_features" : "vcf_features"},
+        "vcf_features" : "vcf_features", 
+        "mgha_common" : "mgha_common"},
       package_data={"vcf_features" : ["template_report.html"]},
       entry_points={
              "console_scripts":[
                "anonymise_fastq = anonymise_fastq.main:main", 
-               "vcf_features = vcf_features.main:main"
+               "vcf_features = vcf_features.main:main",
+               "mgha_job_server = vcf_features.server:main"
              ]
             },
       url="https://github.com/edmundlth/MGHA_bioinformatics",
@@ -0,0 +1,92 @@
+"""
+Parallel BGZF output of anonymise_fastq (`anonymise_fastq/bgzf_writer.py`).
+"""
+
+import gzip
+import struct
+
+import pytest
+import Bio.bgzf as bgzf
+
+from anonymise_fastq import main
+from anonymise_fastq.bgzf_writer import ParallelBgzfWriter, BLOCK_SIZE, _EOF_BLOCK
+
+
+def read_blocks(path):
+    """
+    Split the BGZF file at `path` into its blocks,
+    returning the (offset, block) pairs.
+    """
+    with open(path, 'rb') as infile:
+        data = infile.read()
+    blocks = []
+    offset = 0
+    while offset < len(data):
+        assert data[offset:offset + 4] == b"\x1f\x8b\x08\x04"
+        assert data[offset + 12:offset + 16] == b"BC\x02\x00"
+        block_size = struct.unpack("<H", data[offset + 16:offset + 18])[0] + 1
+        blocks.append((offset, data[offset:offset + block_size]))
+        offset += block_size
+    return blocks
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_blocks_and_eof(tmp_path, threads):
+    path = str(tmp_path / "out.gz")
+    text = "".join("line %i\n" % i for i in range(50000))
+    with ParallelBgzfWriter(path, threads=threads) as outfile:
+        outfile.write(text)
+    blocks = read_blocks(path)
+    assert blocks[-1][1] == _EOF_BLOCK
+    sizes = [struct.unpack("<I", block[-4:])[0] for offset, block in blocks[:-1]]
+    assert all(size == BLOCK_SIZE for size in sizes[:-1])
+    assert 0 < sizes[-1] <= BLOCK_SIZE
+    with gzip.open(path, 'rt') as infile:
+        assert infile.read() == text
+    with bgzf.BgzfReader(path, 'rt') as infile:
+        assert infile.read(len(text)) == text
+
+
+def test_gzi_entries(tmp_path):
+    path = str(tmp_path / "out.gz")
+    text = "".join("read %i\n" % i for i in range(30000))
+    with ParallelBgzfWriter(path, threads=2, gzi=True) as outfile:
+        outfile.write(text)
+    with open(path + ".gzi", 'rb') as infile:
+        n_entries = struct.unpack("<Q", infile.read(8))[0]
+        entries = [struct.unpack("<QQ", infile.read(16)) for _ in range(n_entries)]
+        assert infile.read() == b""
+    # one entry per block after the first, excluding the EOF block
+    blocks = read_blocks(path)[:-1]
+    assert [compressed for compressed, uncompressed in entries] == [offset for offset, block in blocks[1:]]
+    assert [uncompressed for compressed, uncompressed in entries] == \
+           [i * BLOCK_SIZE for i in range(1, len(blocks))]
+    # every entry is a valid seek target
+    with bgzf.BgzfReader(path, 'rb') as infile:
+        for compressed, uncompressed in entries:
+            infile.seek(bgzf.make_virtual_offset(compressed, 0))
+            assert infile.read(16) == text.encode()[uncompressed:uncompressed + 16]
+
+
+def test_utf8(tmp_path):
+    path = str(tmp_path / "out.gz")
+    text = "@read 1 Zürich ✓\nACGT\n+\nIIII\n"
+    with ParallelBgzfWriter(path) as outfile:
+        outfile.write(text)
+    with gzip.open(path, 'rt', encoding="utf-8") as infile:
+        assert infile.read() == text
+
+
+@pytest.mark.parametrize("args", [["--gzi"],
+                                  ["--gzi", "--outfile_compress", "gzip"],
+                                  ["--threads", "4"],
+                                  ["--threads", "0", "--outfile_compress", "bgzip"]])
+def test_options_need_bgzip(args):
+    with pytest.raises(SystemExit):
+        main.parse_inputs(main.argparser(), ["--infilepath", "in.fastq"] + args)
+
+
+def test_bgzip_options():
+    user_inputs = main.parse_inputs(main.argparser(), ["--infilepath", "in.fastq", "--gzi", "--threads", "4",
+                                                       "--outfile_compress", "bgzip"])
+    assert user_inputs.gzi and user_inputs.threads == 4
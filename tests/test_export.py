@@ -0,0 +1,100 @@
+"""
+Columnar export of the vcf_features results (`vcf_features/export.py`).
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from vcf_features.export import (export_features, load_features, features_output_record,
+                                 encode_column, assignment_column, MANIFEST_FILENAME)
+
+
+@pytest.mark.parametrize("encoding, values", [
+    ("plain", [3, 1, 4, 1, 5]),
+    ("dictionary", ["1", "X", "1", "chrUn_KI270302v1", "X"]),
+    ("offsets", ["A", "", "ACGTACGTACGTACGTACGTACGTACGTACGT", "T,G", "Ä"]),
+    ("plain", []),
+    ("dictionary", []),
+    ("offsets", []),
+    ])
+def test_column_round_trip(encoding, values):
+    arrays, info = encode_column("assignment_x", np.array(values, dtype=object), encoding)
+    assert info["encoding"] == encoding
+    manifest = {"columns" : {"x" : info}}
+    assert list(assignment_column(manifest, arrays, "x")) == values
+
+
+def test_offsets_are_not_padded():
+    values = ["A"] * 1000 + ["A" * 10000]
+    arrays, info = encode_column("assignment_ref", values, "offsets")
+    assert arrays["assignment_ref_data"].dtype == np.uint8
+    assert arrays["assignment_ref_data"].nbytes == 1000 + 10000
+    assert list(arrays["assignment_ref_offsets"][:3]) == [0, 1, 2]
+
+
+def output_record():
+    df_load = pd.DataFrame([[1, 0, 2], [0, 3, 0], [4, 4, 4]],
+                           index=["m.vcf:ZED", "m.vcf:ALPHA", "s.vcf"],
+                           columns=["G1", "G2", "G3"])
+    assignments = {
+        "m.vcf" : pd.DataFrame({"variant" : [0, 0, 2],
+                                "gene"    : ["G1", "G3", "G2"],
+                                "CHROM"   : ["1", "1", "X"],
+                                "POS"     : [150, 150, 900],
+                                "REF"     : ["A", "A", "ACGTTTTTTTTTTTTT"],
+                                "ALT"     : ["T", "T", "A"]},
+                               columns=["variant", "gene", "CHROM", "POS", "REF", "ALT"]),
+        "s.vcf" : pd.DataFrame({"variant" : [5],
+                                "gene"    : ["G3"],
+                                "CHROM"   : ["2"],
+                                "POS"     : [42],
+                                "REF"     : ["G"],
+                                "ALT"     : ["GA"]},
+                               columns=["variant", "gene", "CHROM", "POS", "REF", "ALT"]),
+        }
+    return {
+        "BED file"      : "genes.bed",
+        "VCF files"     : ["data/m.vcf", "data/s.vcf"],
+        "labels"        : ["case", "control"],
+        "df_load"       : df_load,
+        "vcf_info_dict" : {"m.vcf" : (assignments["m.vcf"], 1, 2, "case", 10, 2),
+                           "s.vcf" : (assignments["s.vcf"], 0, 3, "control", 4, 1)},
+        "label_dict"    : {"m.vcf:ZED" : "case", "m.vcf:ALPHA" : "case", "s.vcf" : "control"},
+        }
+
+
+def test_export_round_trip(tmp_path):
+    record = output_record()
+    directory = export_features(record, str(tmp_path))
+
+    with open(os.path.join(directory, MANIFEST_FILENAME), 'r') as infile:
+        manifest = json.load(infile)
+    assert manifest["columns"]["CHROM"]["encoding"] == "dictionary"
+    assert manifest["columns"]["REF"]["encoding"] == "offsets"
+
+    manifest, arrays = load_features(directory)
+    assert isinstance(arrays["load"], np.memmap)
+    np.testing.assert_array_equal(arrays["load"], record["df_load"].values)
+    assert list(assignment_column(manifest, arrays, "REF")) == ["A", "A", "ACGTTTTTTTTTTTTT", "G"]
+
+    rebuilt = features_output_record(directory)
+    assert rebuilt["df_load"].equals(record["df_load"])
+    assert rebuilt["label_dict"] == record["label_dict"]
+    assert rebuilt["VCF files"] == record["VCF files"]
+    for name, info in record["vcf_info_dict"].items():
+        assert rebuilt["vcf_info_dict"][name][1:] == info[1:]
+        expected = info[0]
+        actual = rebuilt["vcf_info_dict"][name][0][list(expected.columns)]
+        assert actual.astype(str).equals(expected.astype(str))
+
+
+def test_export_without_assignments(tmp_path):
+    record = output_record()
+    record["vcf_info_dict"] = {name : (None,) + info[1:] for name, info in record["vcf_info_dict"].items()}
+    rebuilt = features_output_record(export_features(record, str(tmp_path)))
+    assert rebuilt["df_load"].equals(record["df_load"])
+    assert all(info[0] is None for info in rebuilt["vcf_info_dict"].values())
@@ -0,0 +1,141 @@
+"""
+FastQ record-offset index and sharding (`anonymise_fastq/fastq_index.py`).
+"""
+
+import gzip
+import itertools
+
+import pytest
+import Bio.bgzf as bgzf
+import Bio.SeqIO as seq_io
+
+from anonymise_fastq import fastq_index
+from anonymise_fastq.fastq_index import (build_fastq_index, load_fastq_index, read_fastq_index,
+                                         index_path_for, shard_bounds, open_shard, PLAIN, BGZF)
+
+
+def fastq_text(n_reads):
+    # reads of varying length so that records are not equally spaced
+    return "".join("@read%i/1\n%s\n+\n%s\n" % (i, "ACGT" * (i % 7 + 1), "I" * 4 * (i % 7 + 1))
+                   for i in range(n_reads))
+
+
+def record_starts(text):
+    starts = []
+    pos = 0
+    for i, line in enumerate(text.splitlines(True)):
+        if i % 4 == 0:
+            starts.append(pos)
+        pos += len(line)
+    return starts
+
+
+@pytest.fixture
+def plain(tmp_path):
+    path = tmp_path / "reads.fastq"
+    path.write_text(fastq_text(1000))
+    return str(path)
+
+
+@pytest.fixture
+def bgzf_file(tmp_path):
+    path = str(tmp_path / "reads.fastq.gz")
+    with bgzf.BgzfWriter(path, 'wb') as outfile:
+        outfile.write(fastq_text(1000).encode())
+    return path
+
+
+@pytest.mark.parametrize("every", [1, 3, 16, 17, 100, 1000, 5000])
+def test_plain_offsets(plain, every):
+    with open(plain, 'r') as infile:
+        text = infile.read()
+    index = build_fastq_index(plain, every)
+    assert index.kind == PLAIN
+    assert index.n_records == 1000
+    assert list(index.offsets) == record_starts(text)[::every]
+
+
+@pytest.mark.parametrize("block", [64, 100, 4096])
+def test_plain_offsets_small_blocks(plain, monkeypatch, block):
+    # force many blocks, including ones ending in the middle of a line
+    monkeypatch.setattr(fastq_index, "_SCAN_BLOCK", block)
+    monkeypatch.setattr(fastq_index, "_FIND_LINES", 4)
+    with open(plain, 'r') as infile:
+        text = infile.read()
+    assert list(build_fastq_index(plain, 50).offsets) == record_starts(text)[::50]
+
+
+def test_plain_blank_and_unterminated_lines(tmp_path):
+    text = fastq_text(10)
+    path = tmp_path / "reads.fastq"
+    path.write_text("\n\n" + text + "\n\n")
+    index = build_fastq_index(str(path), 3)
+    assert index.n_records == 10
+    assert list(index.offsets) == [2 + start for start in record_starts(text)[::3]]
+    path.write_text(text.rstrip("\n"))
+    assert build_fastq_index(str(path), 3).n_records == 10
+    path.write_text("")
+    assert build_fastq_index(str(path), 3).n_records == 0
+
+
+def test_plain_malformed(tmp_path):
+    path = tmp_path / "reads.fastq"
+    path.write_text(fastq_text(3) + "@read3/1\nACGT\n")
+    with pytest.raises(RuntimeError, match="not a multiple of 4"):
+        build_fastq_index(str(path), 1)
+    path.write_text("ACGT\n" + fastq_text(3))
+    with pytest.raises(RuntimeError, match="does not start with '@'"):
+        build_fastq_index(str(path), 1)
+
+
+def test_gzip_rejected(tmp_path):
+    path = str(tmp_path / "reads.fastq.gz")
+    with gzip.open(path, 'wt') as outfile:
+        outfile.write(fastq_text(10))
+    with pytest.raises(RuntimeError, match="random access"):
+        build_fastq_index(path, 1)
+
+
+def test_bgzf_offsets(bgzf_file):
+    index = build_fastq_index(bgzf_file, 100)
+    assert index.kind == BGZF
+    assert index.n_records == 1000
+    with bgzf.BgzfReader(bgzf_file, 'rt') as infile:
+        for i, offset in enumerate(index.offsets):
+            infile.seek(offset)
+            assert infile.readline() == "@read%i/1\n" % (100 * i)
+
+
+def test_load_rebuilds_on_new_interval(plain):
+    assert load_fastq_index(plain, every=10).every == 10
+    assert read_fastq_index(index_path_for(plain)).every == 10
+    # any interval is accepted without `every`
+    assert load_fastq_index(plain).every == 10
+    assert load_fastq_index(plain, every=7).every == 7
+    assert read_fastq_index(index_path_for(plain)).every == 7
+
+
+def test_shard_bounds(plain):
+    index = build_fastq_index(plain, 100)
+    bounds = [shard_bounds(index, shard, 3) for shard in [1, 2, 3]]
+    assert [n_reads for offset, n_reads in bounds] == [300, 300, 400]
+    assert [offset for offset, n_reads in bounds] == [index.offsets[0], index.offsets[3], index.offsets[6]]
+    # more shards than indexed reads gives empty shards
+    bounds = [shard_bounds(index, shard, 20) for shard in range(1, 21)]
+    assert sum(n_reads for offset, n_reads in bounds) == 1000
+    assert (None, 0) in bounds
+
+
+@pytest.mark.parametrize("n_shards", [1, 2, 3, 7, 15])
+@pytest.mark.parametrize("kind", ["plain", "bgzf"])
+def test_open_shard_covers_file(plain, bgzf_file, kind, n_shards):
+    path = plain if kind == "plain" else bgzf_file
+    index = load_fastq_index(path, every=70)
+    ids = []
+    for shard in range(1, n_shards + 1):
+        handle, n_reads = open_shard(path, (shard, n_shards), index=index)
+        with handle:
+            reads = list(itertools.islice(seq_io.parse(handle, "fastq"), n_reads))
+        assert len(reads) == n_reads
+        ids.extend(read.id for read in reads)
+    assert ids == ["read%i/1" % i for i in range(1000)]
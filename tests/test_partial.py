@@ -0,0 +1,105 @@
+"""
+Chromosome-sharded map/merge mode of vcf_features (`vcf_features/partial.py`).
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from vcf_features import main
+from vcf_features.analysis import extract_features
+from vcf_features.partial import shard_chroms, read_partial, merge_partials
+from vcf_features.vcf_features import build_chrom_interval_tree
+
+
+VCF_HEADER = ("##fileformat=VCFv4.2\n"
+              "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{}\n")
+
+BED = ("1\t100\t200\tG1\n"
+       "1\t200\t300\tG2\n"
+       "2\t100\t200\tG3\n"
+       "3\t100\t200\tG1\n")
+
+
+def write_vcf(path, samples, rows):
+    with open(path, 'w') as outfile:
+        outfile.write(VCF_HEADER.format("\t".join(samples)))
+        for chrom, pos, genotypes in rows:
+            outfile.write("\t".join([chrom, str(pos), ".", "A", "T", ".", "PASS", ".", "GT"]
+                                    + genotypes) + "\n")
+    return str(path)
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    bed = tmp_path / "genes.bed"
+    bed.write_text(BED)
+    # sample columns out of alphabetical order, a chromosome absent from
+    # the BED file and a gene with regions on two chromosomes
+    vcfs = [write_vcf(tmp_path / "z.vcf", ["ZED", "ALPHA"],
+                      [("1", 150, ["0/1", "0/0"]),
+                       ("2", 150, ["1/1", "0/1"]),
+                       ("3", 150, ["0/1", "1/1"]),
+                       ("X", 150, ["1/1", "1/1"])]),
+            write_vcf(tmp_path / "a.vcf", ["ONLY"],
+                      [("1", 250, ["1/1"]),
+                       ("2", 500, ["0/1"])])]
+    return str(bed), vcfs
+
+
+def run_shards(tmp_path, bed, vcfs, n_shards):
+    paths = []
+    for shard in range(1, n_shards + 1):
+        args = ["--bed", bed, "--vcf"] + vcfs + ["--label", "case", "control",
+                "--shard", "%i/%i" % (shard, n_shards), "--outdir", str(tmp_path / "partials")]
+        main.run(main.parse_inputs(main.argparser(), args))
+        paths.append(str(tmp_path / "partials" / ("partial_%i_of_%i.npz" % (shard, n_shards))))
+    return paths
+
+
+def test_shard_chroms_cover_bed(inputs):
+    tree = build_chrom_interval_tree(inputs[0])
+    groups = [shard_chroms(tree, shard, 2) for shard in [1, 2]]
+    assert sorted(groups[0] + groups[1]) == sorted(tree)
+
+
+@pytest.mark.parametrize("n_shards", [1, 2, 3])
+def test_merge_equals_unsharded(tmp_path, inputs, n_shards):
+    bed, vcfs = inputs
+    df_load, vcf_info_dict, label_dict = extract_features(vcfs, ["case", "control"],
+                                                          build_chrom_interval_tree(bed))
+    merged = merge_partials(run_shards(tmp_path, bed, vcfs, n_shards))
+    # same samples in the same order, same loads
+    assert list(merged["df_load"].index) == ["z.vcf:ZED", "z.vcf:ALPHA", "a.vcf"]
+    assert merged["df_load"].equals(df_load)
+    assert merged["label_dict"] == label_dict
+    for name in vcf_info_dict:
+        assert merged["vcf_info_dict"][name][1:] == vcf_info_dict[name][1:]
+
+
+def test_merge_rejects_missing_shard(tmp_path, inputs):
+    paths = run_shards(tmp_path, *inputs, n_shards=3)
+    with pytest.raises(RuntimeError, match="shards 1 to 3"):
+        merge_partials(paths[:2])
+
+
+def test_merge_rejects_other_bed(tmp_path, inputs):
+    bed, vcfs = inputs
+    paths = run_shards(tmp_path, bed, vcfs, n_shards=2)
+    other_bed = tmp_path / "other.bed"
+    other_bed.write_text(BED.replace("G3", "G4"))
+    (tmp_path / "other").mkdir()
+    other = run_shards(tmp_path / "other", str(other_bed), vcfs, n_shards=2)
+    with pytest.raises(RuntimeError, match="different BED file"):
+        merge_partials([paths[0], other[1]])
+
+
+def test_merge_rejects_overlapping_chroms(tmp_path, inputs):
+    paths = run_shards(tmp_path, *inputs, n_shards=2)
+    partials = [read_partial(path) for path in paths]
+    partials[1]["chroms"] = np.concatenate([partials[1]["chroms"], partials[0]["chroms"][:1]])
+    overlapping = str(tmp_path / "overlapping.npz")
+    np.savez(overlapping, **partials[1])
+    with pytest.raises(RuntimeError, match="is in both partial results"):
+        merge_partials([paths[0], overlapping])
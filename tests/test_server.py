@@ -0,0 +1,89 @@
+"""
+Round trip through the local job server (`vcf_features/server.py`)
+over a Unix socket: a job, an invalid job and shutting the server down.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from mgha_common.client import submit_job
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+READ = ("@HWI-D00119:50:H7AP8ADXX:1:1101:{0}:44446/1\n"
+        "AAAGCGGCACTTGTGAAGTG\n"
+        "+\n"
+        "IIIIIIIIIIIIIIIIIIII\n")
+
+
+def server_command(socket_path, *args):
+    return [sys.executable, "-m", "vcf_features.server", "--socket", socket_path] + list(args)
+
+
+def server_env():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([REPO_DIR, env.get("PYTHONPATH", "")])
+    env["MPLBACKEND"] = "Agg"
+    return env
+
+
+def send_request(socket_path, request):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps(request).encode() + b"\n")
+        with sock.makefile('rb') as reply_file:
+            return json.loads(reply_file.readline())
+
+
+@pytest.fixture
+def server(tmp_path):
+    # keep the socket path short, Unix socket paths are limited to ~100 bytes
+    socket_path = str(tmp_path / "s.sock")
+    process = subprocess.Popen(server_command(socket_path, "--workers", "1"),
+                               env=server_env())
+    deadline = time.time() + 30
+    while not os.path.exists(socket_path):
+        if process.poll() is not None or time.time() > deadline:
+            process.kill()
+            pytest.fail("Job server did not start.")
+        time.sleep(0.05)
+    yield socket_path
+    if process.poll() is None:
+        process.kill()
+    process.wait()
+
+
+def test_job(server, tmp_path):
+    with open(tmp_path / "in.fastq", 'w') as outfile:
+        outfile.write("".join(READ.format(i) for i in range(10)))
+    result = submit_job(server, "anonymise_fastq",
+                        ["--infilepath", "in.fastq", "--outfilepath", "out.fastq"],
+                        cwd=str(tmp_path))
+    assert result == 10
+    with open(tmp_path / "out.fastq", 'r') as infile:
+        assert len(infile.readlines()) == 40
+
+
+def test_invalid_arguments(server, tmp_path):
+    reply = send_request(server, {"job": "anonymise_fastq", "args": ["--bogus"], "cwd": str(tmp_path)})
+    assert reply["status"] == "error"
+    assert "--bogus" in reply["message"]
+    reply = send_request(server, {"job": "vcf_features", "args": [], "cwd": str(tmp_path)})
+    assert reply["status"] == "error"
+    # the server keeps serving after a failed job
+    assert send_request(server, {"job": "no_such_job", "args": [], "cwd": str(tmp_path)})["status"] == "error"
+
+
+def test_shutdown(server):
+    subprocess.check_call(server_command(server, "--shutdown"), env=server_env())
+    deadline = time.time() + 30
+    while os.path.exists(server) and time.time() < deadline:
+        time.sleep(0.05)
+    assert not os.path.exists(server)
@@ -0,0 +1,103 @@
+"""
+Gene loads of multi-sample VCF files (`vcf_features/vcf_features.py`
+and `vcf_features/analysis.py`).
+"""
+
+import numpy as np
+import pytest
+
+from mgha_common.memory import MemoryBudget
+from vcf_features.analysis import extract_features
+from vcf_features.vcf_features import (build_chrom_interval_tree, vcf_to_df, sample_columns,
+                                       assign_genes, alt_allele_counts, gene_load)
+
+
+VCF_HEADER = ("##fileformat=VCFv4.2\n"
+              "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\t{}\n")
+
+BED = ("1\t100\t200\tG1\n"
+       "1\t200\t300\tG2\n"
+       "2\t100\t200\tG3\n")
+
+
+def write_vcf(path, samples, rows):
+    with open(path, 'w') as outfile:
+        outfile.write(VCF_HEADER.format("\t".join(samples)))
+        for chrom, pos, fmt, genotypes in rows:
+            outfile.write("\t".join([chrom, str(pos), ".", "A", "T", ".", "PASS", ".", fmt]
+                                    + genotypes) + "\n")
+    return str(path)
+
+
+@pytest.fixture
+def bed(tmp_path):
+    path = tmp_path / "genes.bed"
+    path.write_text(BED)
+    return build_chrom_interval_tree(str(path))
+
+
+def test_alt_allele_counts(tmp_path):
+    vcf = write_vcf(tmp_path / "c.vcf", ["S1", "S2", "S3"],
+                    [("1", 150, "GT",    ["0/1", "1/1", "./."]),
+                     ("1", 160, "DP:GT", ["3:1|2", "4:0|0", "5:10/0"]),
+                     ("1", 170, "GT:DP", ["0/0", "1", "./1:7"])])
+    header, df_vcf = vcf_to_df(vcf)
+    samples = sample_columns(df_vcf)
+    assert samples == ["S1", "S2", "S3"]
+    np.testing.assert_array_equal(alt_allele_counts(df_vcf, samples),
+                                  [[1, 2, 0], [2, 0, 1], [0, 1, 1]])
+    np.testing.assert_array_equal(alt_allele_counts(df_vcf, samples, rows=np.array([2])),
+                                  [[0, 1, 1]])
+
+
+def test_gene_load_skips_unassigned_sites(tmp_path, bed):
+    vcf = write_vcf(tmp_path / "u.vcf", ["S1", "S2"],
+                    [("1", 150, "GT", ["0/1", "0/0"]),
+                     ("1", 5000, "GT", ["1/1", "1/1"]),
+                     ("3", 150, "GT", ["1/1", "1/1"]),
+                     ("1", 200, "GT", ["1/1", "0/1"])])
+    header, df_vcf = vcf_to_df(vcf)
+    samples = sample_columns(df_vcf)
+    df_assignment, no_chrom, no_intersection = assign_genes(df_vcf, bed)
+    assert no_chrom == [2] and no_intersection == [1]
+    df_load = gene_load(df_vcf, df_assignment, samples)
+    # BED intervals are half-open: POS 200 is in G2 only
+    assert df_load.loc["S1"].to_dict() == {"G1": 1, "G2": 2}
+    assert df_load.loc["S2"].to_dict() == {"G1": 0, "G2": 1}
+
+
+@pytest.mark.parametrize("budget", [None, MemoryBudget(2 ** 30, minimum=1, maximum=1)])
+def test_sample_order_is_kept(tmp_path, bed, budget):
+    # sample columns out of alphabetical order, only ZED carries alternate alleles
+    vcf = write_vcf(tmp_path / "m.vcf", ["ZED", "ALPHA"],
+                    [("1", 150, "GT", ["0/1", "0/0"]),
+                     ("1", 250, "GT", ["1/1", "0/0"]),
+                     ("2", 150, "GT:DP", ["0|1:3", "0/0:4"])])
+    df_load, vcf_info_dict, label_dict = extract_features([vcf], ["case"], bed, budget=budget)
+    assert list(df_load.index) == ["m.vcf:ZED", "m.vcf:ALPHA"]
+    assert df_load.loc["m.vcf:ZED"].to_dict() == {"G1": 1, "G2": 2, "G3": 1}
+    assert df_load.loc["m.vcf:ALPHA"].to_dict() == {"G1": 0, "G2": 0, "G3": 0}
+    assert label_dict == {"m.vcf:ZED": "case", "m.vcf:ALPHA": "case"}
+    assert vcf_info_dict["m.vcf"][4:] == (3, 2)
+
+
+def test_overlapping_genes_and_single_sample(tmp_path):
+    bed = tmp_path / "overlap.bed"
+    bed.write_text("1\t100\t300\tG1\n"
+                   "1\t150\t200\tG2\n")
+    tree = build_chrom_interval_tree(str(bed))
+    multi = write_vcf(tmp_path / "multi.vcf", ["S2", "S1"],
+                      [("1", 160, "GT", ["0/1", "1|1"]),
+                       ("1", 250, "GT", ["1/1", "0/0"])])
+    # a single sample VCF without a FORMAT column: the last column is the genotype
+    single = tmp_path / "single.vcf"
+    single.write_text("##fileformat=VCFv4.2\n"
+                      "#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tS\n"
+                      "1\t160\t.\tA\tT\t.\tPASS\t.\t0/1\n")
+    df_load, vcf_info_dict, label_dict = extract_features([multi, str(single)], ["a", "b"], tree)
+    assert list(df_load.index) == ["multi.vcf:S2", "multi.vcf:S1", "single.vcf"]
+    # a variant in two overlapping genes counts towards both
+    assert df_load.loc["multi.vcf:S2"].to_dict() == {"G1": 3, "G2": 1}
+    assert df_load.loc["multi.vcf:S1"].to_dict() == {"G1": 2, "G2": 2}
+    assert df_load.loc["single.vcf"].to_dict() == {"G1": 1, "G2": 1}
+    assert len(vcf_info_dict["multi.vcf"][0]) == 3
@@ -0,0 +1,393 @@
+"""
+The analysis behind the `vcf_features` commandline tool: gene loads of 
+the VCF files, partial results and exports, PCA plots and the HTML report. 
+
+Kept apart from `main.py` so that the commandline tool only imports 
+pandas, scikit-learn and matplotlib when it runs a job itself, 
+not when it submits the job to a job server. 
+"""
+
+import os
+
+import pandas as pd
+import numpy as np
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt 
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from mpl_toolkits.mplot3d import Axes3D
+from sklearn.decomposition import PCA
+
+
+from .vcf_features import vcf_to_df, vcf_chunks, build_chrom_interval_tree, sample_columns, assign_genes, gene_load
+from .partial import shard_chroms, write_partial, merge_partials
+from .export import export_features, features_output_record
+from mgha_common.memory import MemoryBudget
+
+
+def run(user_inputs, chrom_interval_tree=None):
+    """
+    Run the analysis described by the parsed commandline 
+    arguments `user_inputs`. A prebuilt `chrom_interval_tree` 
+    for `user_inputs.bed` can be supplied (e.g. by the job server) 
+    to avoid rebuilding it. 
+
+    With `--shard i/N` only the i-th of N groups of BED chromosomes 
+    is processed and a partial result is written instead of the report. 
+    With `--merge` the partial results are combined and reported. 
+    With `--from_features` a previous export is reported again. 
+    """
+    if user_inputs.merge:
+        output_record = merge_partials(user_inputs.merge)
+        write_outputs(output_record, user_inputs.outdir, 
+                      plot_mode=user_inputs.plot_mode, plot_subsample=user_inputs.plot_subsample)
+        return 0
+    if user_inputs.from_features:
+        output_record = features_output_record(user_inputs.from_features)
+        write_outputs(output_record, user_inputs.outdir, export=False, 
+                      plot_mode=user_inputs.plot_mode, plot_subsample=user_inputs.plot_subsample)
+        return 0
+
+    if not user_inputs.label:
+        user_inputs.label = ["None"] * len(user_inputs.vcf)
+
+
+    
+    # Initialise recording
+    output_record = {
+    "BED file"  : user_inputs.bed,
+    "VCF files" : user_inputs.vcf,
+    "labels"    : user_inputs.label
+    }
+    
+
+    # parse input files
+    if chrom_interval_tree is None:
+        chrom_interval_tree = build_chrom_interval_tree(user_inputs.bed)
+    chroms = None
+    if user_inputs.shard is not None:
+        chroms = shard_chroms(chrom_interval_tree, *user_inputs.shard)
+    budget = None
+    if user_inputs.max_memory:
+        budget = MemoryBudget(user_inputs.max_memory)
+    df_load, vcf_info_dict, label_dict = extract_features(user_inputs.vcf, 
+                                                          user_inputs.label, 
+                                                          chrom_interval_tree, 
+                                                          chroms=chroms, 
+                                                          keep_unlisted=user_inputs.shard is None or user_inputs.shard[0] == 1, 
+                                                          budget=budget)
+    if budget is not None:
+        budget.check("vcf_features")
+
+    output_record["df_load"] = df_load
+    output_record["vcf_info_dict"] = vcf_info_dict
+    output_record["label_dict"] = label_dict
+    output_record["chrom_interval_tree"] = chrom_interval_tree
+
+    if user_inputs.shard is not None:
+        if not os.path.isdir(user_inputs.outdir):
+            os.mkdir(user_inputs.outdir)
+        shard, n_shards = user_inputs.shard
+        partial_path = os.path.join(user_inputs.outdir, "partial_%i_of_%i.npz" % (shard, n_shards))
+        write_partial(partial_path, output_record, user_inputs.shard, chroms)
+        return 0
+
+    write_outputs(output_record, user_inputs.outdir, 
+                      plot_mode=user_inputs.plot_mode, plot_subsample=user_inputs.plot_subsample)
+    return 0
+
+
+def extract_features(vcf_files, labels, chrom_interval_tree, chroms=None, keep_unlisted=True, budget=None):
+    """
+    Compute the mutation load of every gene for every sample 
+    in the VCF files `vcf_files` (with class labels `labels`). 
+    If `chroms` is given, only variants on those chromosomes are 
+    considered, together with the variants on chromosomes absent 
+    from the BED file if `keep_unlisted` is True. 
+    If a `mgha_common.memory.MemoryBudget` is given, the VCF files are 
+    read in chunks sized by the budget instead of whole. 
+
+    Returns 
+      - df_load : (samples x genes) DataFrame of mutation loads, 
+      - vcf_info_dict : {vcf name : (variant-gene assignment, 
+        number of variants on chromosomes absent from the BED file, 
+        number of variants not in any region, label, 
+        number of variants, number of samples)}, 
+      - label_dict : {sample name : label}. 
+    """
+    if len(vcf_files) != len(labels):
+        raise RuntimeError("Expected one label per VCF file, got %i labels for %i VCF files." 
+                           % (len(labels), len(vcf_files)))
+    if chroms is not None:
+        bed_chroms = set(chrom_interval_tree)
+        chrom_interval_tree = {chrom : chrom_interval_tree[chrom] for chrom in chroms}
+
+    vcf_info_dict = {}
+    sample_loads = []
+    label_dict = {}
+    for vcffilepath, vcf_label in zip(vcf_files, labels):
+        vcf_name = os.path.basename(vcffilepath)
+
+        if budget is None:
+            vcf_header, df_vcf = vcf_to_df(vcffilepath)
+            chunks = [df_vcf]
+        else:
+            chunks = vcf_chunks(vcffilepath, budget)
+
+        assignments = []
+        df_sample_load = None
+        n_no_chrom = 0
+        n_no_intersection = 0
+        n_variant = 0
+        for df_vcf in chunks:
+            if chroms is not None:
+                chrom_column = df_vcf.iloc[:, 0]
+                in_shard = chrom_column.isin(chroms)
+                if keep_unlisted:
+                    in_shard |= ~chrom_column.isin(bed_chroms)
+                df_vcf = df_vcf[in_shard.values]
+
+            # Assign variants to genes once per site, 
+            # then count alleles for all sample columns at once. 
+            samples = sample_columns(df_vcf)
+            df_assignment, no_chrom, no_intersection = assign_genes(df_vcf, chrom_interval_tree)
+            # keep a running total rather than the loads of every chunk
+            df_chunk_load = gene_load(df_vcf, df_assignment, samples)
+            if df_sample_load is None:
+                df_sample_load = df_chunk_load
+            else:
+                df_sample_load = df_sample_load.add(df_chunk_load, fill_value=0)
+            # refer to variants by their row in the file rather than in the chunk
+            df_assignment["variant"] = df_vcf.index.values[df_assignment["variant"].values]
+            assignments.append(df_assignment)
+            n_no_chrom += len(no_chrom)
+            n_no_intersection += len(no_intersection)
+            n_variant += df_vcf.shape[0]
+
+        vcf_info_dict[vcf_name] = (pd.concat(assignments, ignore_index=True), 
+                                   n_no_chrom, 
+                                   n_no_intersection, 
+                                   vcf_label, 
+                                   n_variant, 
+                                   len(samples))
+
+        # keep the sample order of the VCF file, which the names below assume
+        df_sample_load = df_sample_load.reindex(samples).fillna(value=0)
+        # Single sample VCFs are named by file, 
+        # samples of a multi-sample VCF by file and sample. 
+        if len(samples) == 1:
+            df_sample_load.index = [vcf_name]
+        else:
+            df_sample_load.index = ["%s:%s" % (vcf_name, sample) for sample in samples]
+        for name in df_sample_load.index:
+            label_dict[name] = vcf_label
+        sample_loads.append(df_sample_load)
+    df_load = pd.concat(sample_loads, sort=True).fillna(value=0).astype(int).sort_index(axis=1)
+    return df_load, vcf_info_dict, label_dict
+
+
+def write_outputs(output_record, outdir, export=True, plot_mode="auto", plot_subsample=None):
+    """
+    Do PCA on the mutation loads in `output_record` 
+    and write the plots and the HTML report to `outdir`. 
+    If `export` is True, the load matrix and variant-gene 
+    assignments are also written to `<outdir>/features/` 
+    (see `export.py`). 
+    See `plot_pca` for `plot_mode` and `plot_subsample`. 
+    """
+    df_load = output_record["df_load"]
+    label_dict = output_record["label_dict"]
+
+    # Do PCA on mutation load data (contained in df_load).
+    X_reduced = PCA(n_components=3).fit_transform(df_load)
+    y = pd.Series([label_dict[name] for name in df_load.index])
+
+
+    # Create the output directory if it hasn't already existed. 
+    if not os.path.isdir(outdir):
+        os.mkdir(outdir)
+
+
+    # Plot PCA. 
+    output_record.update(save_pca_plots(X_reduced, y, outdir, plot_mode, plot_subsample))
+
+    if export:
+        export_features(output_record, outdir)
+
+
+    # Generate a HTML report. 
+    report_html = write_report(output_record)
+    with open(os.path.join(outdir, "report.html"), 'w') as outfile:
+        outfile.write(report_html)
+    return output_record
+
+
+def save_pca_plots(X_reduced, y, outdir, plot_mode="auto", plot_subsample=None):
+    """
+    Save the 2 and 3 dimensional PCA plots to `outdir`. 
+    Returns the file names to be recorded in `output_record`. 
+    """
+    filenames = {}
+    for n_dim in [2, 3]:
+        fig, ax = plot_pca(X_reduced, y, n_dim=n_dim, figsize=(5, 5), 
+                           mode=plot_mode, subsample=plot_subsample)
+        filename = "load_pca%id.png" % n_dim
+        fig.savefig(os.path.join(outdir, filename), format='png', bbox_inches='tight')
+        filenames["load_pca%id_filename" % n_dim] = filename
+    return filenames
+
+
+
+# Cohorts larger than this are plotted as hexbin density in "auto" mode.
+LARGE_COHORT = 2000
+
+def plot_pca(X_reduced, y, n_dim=2, figsize=(10, 10), mode="auto", subsample=None):
+    """
+    Given a the PCA reduced feature vectors `X_reduced`
+    together with their class labels `y`, 
+    generate a 2 or 3 dimensional scatter plot. 
+
+    mode :: "scatter" | "hexbin" | "auto"
+      - "hexbin" draws the 2 dimensional plot as a density of 
+        samples with the class centroids on top, which stays 
+        readable and fast to render for very many samples. 
+        3 dimensional plots are always scatter plots. 
+      - "auto" uses "hexbin" for more than `LARGE_COHORT` samples, 
+        and then also subsamples the 3 dimensional scatter plot 
+        to `LARGE_COHORT` samples unless `subsample` is given. 
+    subsample :: Int
+      - if given, scatter plots only show a random 
+        subset of this many samples. 
+
+    The figure is not managed by pyplot, so repeated calls 
+    (e.g. in a job server) do not draw on the same figure 
+    and need no closing. 
+    """
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    if n_dim == 3:
+        ax = fig.add_subplot(111, projection='3d')
+    elif n_dim == 2:
+        ax = fig.add_subplot(111)
+    else:
+        raise RuntimeError("Invalid number of dimension.")
+
+    n_samples = X_reduced.shape[0]
+    if mode == "auto":
+        mode = "hexbin" if n_samples > LARGE_COHORT else "scatter"
+        if n_samples > LARGE_COHORT and subsample is None:
+            subsample = LARGE_COHORT
+    if mode == "hexbin" and n_dim == 2:
+        hexbin = ax.hexbin(X_reduced[:, 0], X_reduced[:, 1], 
+                           gridsize=50, bins='log', mincnt=1, cmap='Greys')
+        fig.colorbar(hexbin, ax=ax, label="Number of samples")
+    elif subsample is not None and subsample < n_samples:
+        rows = np.sort(np.random.RandomState(0).choice(n_samples, subsample, replace=False))
+        X_reduced = X_reduced[rows]
+        y = y.iloc[rows].reset_index(drop=True)
+    # smaller markers for large cohorts
+    marker_size = 40 if X_reduced.shape[0] <= LARGE_COHORT else 4
+
+    n_classes = len(set(y))
+    for index, label, color in zip(range(n_classes), 
+                               set(y), 
+                               plt.cm.Set1(np.linspace(0, 1, num=n_classes))):   
+        row_index = y.index[y == label]
+        if n_dim == 3:
+            ax.scatter(X_reduced[row_index, 0], 
+                       X_reduced[row_index, 1], 
+                       X_reduced[row_index, 2], 
+                       color=color,
+                       label=label,
+                       s=marker_size)
+            ax.set_zlabel("PC3")
+        elif mode == "hexbin":
+            # class centroids
+            ax.scatter(X_reduced[row_index, 0].mean(), 
+                       X_reduced[row_index, 1].mean(), 
+                       color=color,
+                       label=label,
+                       marker='X',
+                       edgecolors='k',
+                       s=120)
+        elif n_dim == 2:
+            ax.scatter(X_reduced[row_index, 0], 
+                       X_reduced[row_index, 1], 
+                       color=color,
+                       label=label,
+                       s=marker_size)
+    if X_reduced.shape[0] < n_samples:
+        ax.set_title("First %i Principal Components (%i of %i samples)" 
+                     % (n_dim, X_reduced.shape[0], n_samples))
+    else:
+        ax.set_title("First %i Principal Components" % n_dim)
+    ax.set_xlabel("PC1")
+    ax.set_ylabel("PC2")
+    ax.legend(loc='best')
+    return fig, ax
+
+
+
+############################
+def write_report(output_record):
+    """
+    Given the output of various intermediate data
+    of `main()` recorded in the dictionary `output_record`, 
+    generate a HTML string as report. 
+    """
+    formating_data = {
+    "bedfilepath"           : output_record["BED file"], 
+    "label_file_html_table" : label_file_html_table(output_record["VCF files"], output_record["labels"]),
+    "vcf_info_html_table"   : vcf_info_html_table(output_record["vcf_info_dict"]), 
+    "fig_pca2d"             : """<img src="%s" alt="2D PCA plot">""" % output_record["load_pca2d_filename"],
+    "fig_pca3d"             : """<img src="%s" alt="3D PCA plot">""" % output_record["load_pca3d_filename"],
+    }
+
+    this_dir, this_filename = os.path.split(__file__)
+    template_path = os.path.join(this_dir, "template_report.html")
+    with open(template_path, 'r') as infile:
+        template = infile.read()
+        output = template.format(**formating_data)
+    return output
+
+def label_file_html_table(vcf_files, labels):
+    """
+    Given a list of vcf file paths in `vcf_files`, 
+    and their corresponding class label in `labels`, 
+    generate a label:vcf_file HTML table. 
+    """
+    row_template = """<tr>
+        <td> {} </td>
+        <td> {} </td>
+        </tr>\n
+        """
+    return "".join(row_template.format(str(label), vfile) 
+                   for vfile, label in zip(vcf_files, labels))
+
+def vcf_info_html_table(vcf_info_dict):
+    """
+    Generate a HTML table summarising 
+    vcf information collected in `vcf_info_dict`. 
+    """
+    row_template = """
+        <tr>
+        <td> {} </td>
+        <td> {} </td>
+        <td> {} </td>
+        <td> {} </td>
+        <td> {} </td>
+        <td> {} </td>
+        </tr>\n
+        """
+    rows = []
+    for vcf_name in vcf_info_dict: 
+        df_assignment, n_no_chrom, n_no_intersection, vcf_label, n_variant, n_sample = vcf_info_dict[vcf_name]
+        rows.append(row_template.format(vcf_name, 
+                                        vcf_label, 
+                                        n_sample,
+                                        n_variant,
+                                        n_no_chrom,
+                                        n_no_intersection))
+    return "".join(rows)
@@ -0,0 +1,218 @@
+"""
+Columnar export of the vcf_features results.
+
+The load matrix, its sample and gene indexes and the variant-gene
+assignments are written as `.npy` arrays (one per column) next to a JSON
+manifest describing them, in `<outdir>/features/`. Every array can be
+memory mapped with `numpy.load(path, mmap_mode='r')`, so downstream jobs
+can read (parts of) them without copies or re-running the pipeline:
+
+    manifest, arrays = load_features("analysis_output/features")
+    arrays["load"][:, arrays["genes"] == "BRCA2"]
+
+`vcf_features --from_features DIR` regenerates the plots and report
+from an export instead of recomputing it.
+
+Arrays:
+  - load               : int64 (samples x genes) mutation load
+  - samples            : sample names, rows of `load`
+  - sample_labels      : class label of each sample
+  - genes              : gene names, columns of `load`
+  - assignment_vcf     : int32 index into manifest["vcfs"]
+  - assignment_variant : int64 row of the variant in its VCF
+  - assignment_gene    : int32 index into `genes`
+  - assignment_pos     : int64 POS of the variant
+  - assignment_chrom, assignment_chrom_values
+                       : int32 index into the CHROM names in `assignment_chrom_values`
+  - assignment_ref_data, assignment_ref_offsets (same for alt)
+                       : uint8 UTF-8 bytes of all REF (ALT) alleles one after
+                         the other, and the int64 offsets of allele i at
+                         data[offsets[i]:offsets[i + 1]]
+Variable length strings are stored in these two ways rather than as
+fixed-width arrays, which would pad every allele to the longest one.
+manifest["columns"] records how each assignment column is stored, and
+`assignment_column` decodes a column.
+The assignment arrays are absent for results merged from partial results
+(see `partial.py`), which do not keep them.
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+
+FEATURES_DIRNAME = "features"
+MANIFEST_FILENAME = "manifest.json"
+FORMAT_VERSION = 2
+
+# column : encoding, see `encode_column`
+_ASSIGNMENT_COLUMNS = [("variant", "plain"), ("CHROM", "dictionary"), ("POS", "plain"),
+                       ("REF", "offsets"), ("ALT", "offsets")]
+
+
+def encode_column(name, values, encoding):
+    """
+    Encode the column `values` as arrays named after `name`.
+    Returns ({array name : array}, manifest entry of the column).
+
+    encoding :: "plain" | "dictionary" | "offsets"
+      - "plain" : one int64 array `name`.
+      - "dictionary" : int32 codes `name` into the distinct
+        values `name + '_values'`, for few distinct strings.
+      - "offsets" : the UTF-8 bytes of all the strings in `name + '_data'`
+        and the start of each string (and the end of the last)
+        in `name + '_offsets'`, for strings of varying length.
+    """
+    if encoding == "plain":
+        return {name : np.asarray(values, dtype=np.int64)}, {"encoding" : encoding, "array" : name}
+    elif encoding == "dictionary":
+        codes, uniques = pd.factorize(np.asarray(values, dtype=str))
+        return ({name : codes.astype(np.int32), name + "_values" : np.asarray(uniques, dtype=str)},
+                {"encoding" : encoding, "codes" : name, "values" : name + "_values"})
+    elif encoding == "offsets":
+        encoded = [str(value).encode("utf-8") for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum(np.array([len(value) for value in encoded], dtype=np.int64), out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return ({name + "_data" : data, name + "_offsets" : offsets},
+                {"encoding" : encoding, "data" : name + "_data", "offsets" : name + "_offsets"})
+    else:
+        raise RuntimeError("Unknown column encoding '%s'." % encoding)
+
+
+def assignment_column(manifest, arrays, column):
+    """
+    Decode the assignment column `column` (e.g. "REF") of an
+    export read by `load_features`. Returns an int64 array
+    for integer columns and an object array of strings otherwise.
+    """
+    info = manifest["columns"][column]
+    if info["encoding"] == "plain":
+        return arrays[info["array"]]
+    elif info["encoding"] == "dictionary":
+        return np.asarray(arrays[info["values"]], dtype=object)[arrays[info["codes"]]]
+    elif info["encoding"] == "offsets":
+        data = arrays[info["data"]].tobytes()
+        offsets = arrays[info["offsets"]].tolist()
+        return np.array([data[start:end].decode("utf-8")
+                         for start, end in zip(offsets[:-1], offsets[1:])], dtype=object)
+    else:
+        raise RuntimeError("Unknown column encoding '%s'." % info["encoding"])
+
+
+def export_features(output_record, outdir):
+    """
+    Write the load matrix and variant-gene assignments
+    in `output_record` to `<outdir>/features/`.
+    Returns the directory written to.
+    """
+    directory = os.path.join(outdir, FEATURES_DIRNAME)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    df_load = output_record["df_load"]
+    vcf_info_dict = output_record["vcf_info_dict"]
+    label_dict = output_record["label_dict"]
+    vcf_names = list(vcf_info_dict)
+
+    arrays = {
+        "load"          : np.ascontiguousarray(df_load.values, dtype=np.int64),
+        "samples"       : np.array(df_load.index, dtype=str),
+        "sample_labels" : np.array([label_dict[name] for name in df_load.index], dtype=str),
+        "genes"         : np.array(df_load.columns, dtype=str),
+        }
+
+    columns = {}
+    assignments = [vcf_info_dict[name][0] for name in vcf_names]
+    if all(df_assignment is not None for df_assignment in assignments):
+        arrays["assignment_vcf"] = np.concatenate(
+            [np.full(df_assignment.shape[0], i, dtype=np.int32)
+             for i, df_assignment in enumerate(assignments)])
+        arrays["assignment_gene"] = pd.Index(df_load.columns).get_indexer(
+            np.concatenate([df_assignment["gene"].values for df_assignment in assignments])
+            ).astype(np.int32)
+        for column, encoding in _ASSIGNMENT_COLUMNS:
+            if all(column in df_assignment.columns for df_assignment in assignments):
+                values = np.concatenate([df_assignment[column].values for df_assignment in assignments])
+                column_arrays, columns[column] = encode_column("assignment_" + column.lower(), 
+                                                               values, encoding)
+                arrays.update(column_arrays)
+
+    manifest = {
+        "format_version" : FORMAT_VERSION,
+        "bed"            : output_record["BED file"],
+        "vcfs"           : [{"name"              : name,
+                             "file"              : vcf_file,
+                             "label"             : vcf_info_dict[name][3],
+                             "n_no_chrom"        : int(vcf_info_dict[name][1]),
+                             "n_no_intersection" : int(vcf_info_dict[name][2]),
+                             "n_variant"         : int(vcf_info_dict[name][4]),
+                             "n_sample"          : int(vcf_info_dict[name][5])}
+                            for name, vcf_file in zip(vcf_names, output_record["VCF files"])],
+        "columns"        : columns,
+        "arrays"         : {},
+        }
+    for name, array in arrays.items():
+        filename = name + ".npy"
+        np.save(os.path.join(directory, filename), array)
+        manifest["arrays"][name] = {"file"  : filename,
+                                    "dtype" : array.dtype.str,
+                                    "shape" : list(array.shape)}
+
+    # the manifest is written last: its presence marks a complete export
+    with open(os.path.join(directory, MANIFEST_FILENAME), 'w') as outfile:
+        json.dump(manifest, outfile, indent=2)
+    return directory
+
+
+def load_features(directory, mmap_mode='r'):
+    """
+    Read the manifest and the arrays of an export in `directory`.
+    By default the arrays are memory mapped read-only,
+    use `mmap_mode=None` to read them into memory.
+    Returns (manifest dictionary, {name : array}).
+    """
+    with open(os.path.join(directory, MANIFEST_FILENAME), 'r') as infile:
+        manifest = json.load(infile)
+    if manifest["format_version"] != FORMAT_VERSION:
+        raise RuntimeError("Unsupported feature export version %s in %s."
+                           % (manifest["format_version"], directory))
+    arrays = {name : np.load(os.path.join(directory, info["file"]), mmap_mode=mmap_mode)
+              for name, info in manifest["arrays"].items()}
+    return manifest, arrays
+
+
+def features_output_record(directory):
+    """
+    Rebuild the `output_record` dictionary used by
+    `analysis.write_outputs` from an export in `directory`.
+    """
+    manifest, arrays = load_features(directory, mmap_mode=None)
+    df_load = pd.DataFrame(arrays["load"], index=arrays["samples"], columns=arrays["genes"])
+
+    columns = {column : assignment_column(manifest, arrays, column) for column in manifest["columns"]}
+    vcf_info_dict = {}
+    for i, vcf in enumerate(manifest["vcfs"]):
+        df_assignment = None
+        if "assignment_vcf" in arrays:
+            rows = arrays["assignment_vcf"] == i
+            df_assignment = pd.DataFrame({"gene" : arrays["genes"][arrays["assignment_gene"][rows]]})
+            for column, values in columns.items():
+                df_assignment[column] = values[rows]
+        vcf_info_dict[vcf["name"]] = (df_assignment,
+                                      vcf["n_no_chrom"],
+                                      vcf["n_no_intersection"],
+                                      vcf["label"],
+                                      vcf["n_variant"],
+                                      vcf["n_sample"])
+
+    return {
+        "BED file"      : manifest["bed"],
+        "VCF files"     : [vcf["file"] for vcf in manifest["vcfs"]],
+        "labels"        : [vcf["label"] for vcf in manifest["vcfs"]],
+        "df_load"       : df_load,
+        "vcf_info_dict" : vcf_info_dict,
+        "label_dict"    : dict(zip(arrays["samples"], arrays["sample_labels"])),
+        }
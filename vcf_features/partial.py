@@ -0,0 +1,159 @@
+"""
+Partial results for the chromosome-sharded map/merge mode of vcf_features.
+
+The map step (`vcf_features --shard i/N`) processes only the variants on
+the i-th of N groups of BED chromosomes and writes the gene loads and
+unmatched-variant counts of that group to a compressed `.npz` file.
+The merge step (`vcf_features --merge partial_*.npz`) combines the
+partial results of all N shards into the full load matrix, from which the
+PCA and the report are produced as usual.
+
+Variants on chromosomes absent from the BED file are counted by shard 1,
+so that the merged counts equal those of an unsharded run.
+
+Each partial result also records the chromosomes and a checksum of its
+BED file, so that the merge step can check that the shards were computed
+from the same BED file and together cover each of its chromosomes once.
+"""
+
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+
+def shard_chroms(chrom_interval_tree, shard, n_shards):
+    """
+    Split the chromosomes of `chrom_interval_tree` into `n_shards`
+    groups with roughly equal number of regions and return
+    the (sorted) chromosomes of the `shard`-th group, 1 <= shard <= n_shards.
+    The split only depends on the BED file, so every map job
+    computes the same groups.
+    """
+    sizes = [0] * n_shards
+    groups = [[] for _ in range(n_shards)]
+    for chrom in sorted(chrom_interval_tree, key=lambda chrom: (-len(chrom_interval_tree[chrom]), chrom)):
+        lightest = sizes.index(min(sizes))
+        groups[lightest].append(chrom)
+        sizes[lightest] += len(chrom_interval_tree[chrom])
+    return sorted(groups[shard - 1])
+
+
+def bed_checksum(bedfilepath):
+    """
+    MD5 digest of the content of the BED file at `bedfilepath`.
+    """
+    digest = hashlib.md5()
+    with open(bedfilepath, 'rb') as infile:
+        for block in iter(lambda: infile.read(2 ** 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_partial(path, output_record, shard, chroms):
+    """
+    Save the gene loads and per VCF variant counts
+    in `output_record` (as produced by `analysis.run`) for
+    the shard `shard` = (i, N) covering `chroms` to `path`.
+    """
+    df_load = output_record["df_load"]
+    vcf_info_dict = output_record["vcf_info_dict"]
+    label_dict = output_record["label_dict"]
+    vcf_names = list(vcf_info_dict)
+    # n_no_chrom, n_no_intersection, n_variant, n_sample
+    counts = [[vcf_info_dict[name][i] for i in [1, 2, 4, 5]] for name in vcf_names]
+    np.savez_compressed(path,
+                        shard=np.array(shard, dtype=np.int64),
+                        chroms=np.array(chroms, dtype=str),
+                        bed=np.array(output_record["BED file"], dtype=str),
+                        bed_checksum=np.array(bed_checksum(output_record["BED file"]), dtype=str),
+                        bed_chroms=np.array(sorted(output_record["chrom_interval_tree"]), dtype=str),
+                        vcf_files=np.array(output_record["VCF files"], dtype=str),
+                        labels=np.array(output_record["labels"], dtype=str),
+                        vcf_names=np.array(vcf_names, dtype=str),
+                        counts=np.array(counts, dtype=np.int64).reshape(len(vcf_names), 4),
+                        samples=np.array(df_load.index, dtype=str),
+                        sample_labels=np.array([label_dict[name] for name in df_load.index], dtype=str),
+                        genes=np.array(df_load.columns, dtype=str),
+                        load=df_load.values.astype(np.int64))
+
+
+def read_partial(path):
+    with np.load(path, allow_pickle=False) as partial:
+        return {key : partial[key] for key in partial.files}
+
+
+def merge_partials(paths):
+    """
+    Combine the partial results at `paths`, which must
+    be all N shards of the same set of VCF files and BED file,
+    whose chromosomes together cover the BED file exactly once.
+    Returns an `output_record` dictionary as used by `analysis.write_outputs`.
+    The variant-gene assignments are not kept by the
+    partial results and are None in the merged `vcf_info_dict`.
+    """
+    partials = [read_partial(path) for path in paths]
+    first = partials[0]
+
+    n_shards = int(first["shard"][1])
+    shards = sorted(int(partial["shard"][0]) for partial in partials)
+    if shards != list(range(1, n_shards + 1)) \
+    or any(int(partial["shard"][1]) != n_shards for partial in partials):
+        raise RuntimeError("Expected the partial results of shards 1 to %i, got shards %s."
+                           % (n_shards, ", ".join(str(shard) for shard in shards)))
+    for path, partial in zip(paths, partials):
+        if list(partial["vcf_files"]) != list(first["vcf_files"]):
+            raise RuntimeError("Partial result %s was computed from different VCF files than %s."
+                               % (path, paths[0]))
+        if "bed_checksum" not in partial:
+            raise RuntimeError("Partial result %s does not record its BED file checksum, "
+                               "recompute it with this version of vcf_features." % path)
+        # compare contents rather than paths, map jobs may run in different directories
+        if str(partial["bed_checksum"]) != str(first["bed_checksum"]) \
+        or list(partial["bed_chroms"]) != list(first["bed_chroms"]):
+            raise RuntimeError("Partial result %s was computed from a different BED file than %s."
+                               % (path, paths[0]))
+
+    seen = {}
+    for path, partial in zip(paths, partials):
+        for chrom in partial["chroms"]:
+            if chrom in seen:
+                raise RuntimeError("Chromosome %s is in both partial results %s and %s."
+                                   % (chrom, seen[chrom], path))
+            seen[chrom] = path
+    missing = set(first["bed_chroms"]) - set(seen)
+    extra = set(seen) - set(first["bed_chroms"])
+    if missing or extra:
+        raise RuntimeError("The partial results do not cover the chromosomes of %s: "
+                           "missing %s, unexpected %s."
+                           % (first["bed"], sorted(missing) or "none", sorted(extra) or "none"))
+
+    samples = list(first["samples"])
+    df_load = pd.concat([pd.DataFrame(partial["load"],
+                                      index=partial["samples"],
+                                      columns=partial["genes"]).reindex(samples)
+                         for partial in partials],
+                        axis=1, sort=False).fillna(value=0)
+    # a gene with regions on several chromosomes can appear in more than one shard
+    df_load = df_load.T.groupby(level=0).sum().T.astype(int).sort_index(axis=1)
+
+    counts = sum(partial["counts"] for partial in partials)
+    vcf_info_dict = {}
+    for i, (vcf_name, vcf_label) in enumerate(zip(first["vcf_names"], first["labels"])):
+        n_no_chrom, n_no_intersection, n_variant, _ = counts[i]
+        n_sample = first["counts"][i][3]
+        vcf_info_dict[vcf_name] = (None,
+                                   int(n_no_chrom),
+                                   int(n_no_intersection),
+                                   vcf_label,
+                                   int(n_variant),
+                                   int(n_sample))
+
+    return {
+        "BED file"      : str(first["bed"]),
+        "VCF files"     : list(first["vcf_files"]),
+        "labels"        : list(first["labels"]),
+        "df_load"       : df_load,
+        "vcf_info_dict" : vcf_info_dict,
+        "label_dict"    : dict(zip(first["samples"], first["sample_labels"])),
+        }
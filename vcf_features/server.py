@@ -0,0 +1,220 @@
+"""
+Warm local job server.
+
+Every `vcf_features` or `anonymise_fastq` invocation pays for interpreter
+startup, importing pandas / sklearn / matplotlib and (for `vcf_features`)
+building the interval trees of the BED file. This module provides a long
+running service listening on a Unix socket that keeps all of that resident:
+
+  - connections are handled by an asyncio event loop,
+  - jobs run in a pool of worker processes that import the analysis
+    modules once,
+  - each worker keeps the interval trees of recently used BED files in an
+    LRU cache, keyed by path, modification time and size.
+
+The protocol is one JSON object per line. A request is
+    {"job": "vcf_features" | "anonymise_fastq", "args": [...], "cwd": "..."}
+where "args" are the commandline arguments of the corresponding CLI, and
+the reply is
+    {"status": "ok", "result": ...} or {"status": "error", "message": "..."}.
+A request {"job": "shutdown"} stops the server.
+
+Start the server with
+    $ mgha_job_server --socket /path/to/socket
+and submit jobs with the `--server /path/to/socket` option of the CLIs.
+
+The client side (`submit_job`) lives in `mgha_common.client` so that
+submitting a job does not import the analysis modules.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import functools
+import io
+import json
+import os
+import socket
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+from mgha_common.client import submit_job, DEFAULT_SOCKET
+
+
+DEFAULT_CACHE_SIZE = 8
+
+# Large enough for the argument list of a big cohort.
+_LINE_LIMIT = 2 ** 24
+
+
+#########################
+# Worker process
+#########################
+
+_cached_interval_tree = None
+
+
+def _init_worker(cache_size):
+    """
+    Import the analysis modules once per worker
+    and set up the BED interval tree cache.
+    """
+    global _cached_interval_tree
+    # imported here only to make them resident before the first job
+    from .vcf_features import build_chrom_interval_tree
+    from . import analysis
+    from anonymise_fastq import anonymise
+
+    @functools.lru_cache(maxsize=cache_size)
+    def cached_interval_tree(bedfilepath, mtime, size):
+        return build_chrom_interval_tree(bedfilepath)
+    _cached_interval_tree = cached_interval_tree
+
+
+def run_job(job, args, cwd):
+    """
+    Parse `args` with the parser of the CLI named by
+    `job` and run it in the directory `cwd`.
+    Invalid arguments raise a RuntimeError carrying
+    the usage message argparse would have printed.
+    """
+    from . import main as vcf_features_main
+    from anonymise_fastq import main as anonymise_fastq_main
+
+    os.chdir(cwd)
+    if job == "vcf_features":
+        user_inputs = parse_job_args(vcf_features_main.parse_inputs,
+                                     vcf_features_main.argparser(), args)
+        if user_inputs.merge or user_inputs.from_features:
+            return vcf_features_main.run(user_inputs)
+        bed = os.path.abspath(user_inputs.bed)
+        stat = os.stat(bed)
+        tree = _cached_interval_tree(bed, stat.st_mtime, stat.st_size)
+        return vcf_features_main.run(user_inputs, chrom_interval_tree=tree)
+    elif job == "anonymise_fastq":
+        user_inputs = parse_job_args(anonymise_fastq_main.parse_inputs,
+                                     anonymise_fastq_main.argparser(), args)
+        return anonymise_fastq_main.run(user_inputs)
+    else:
+        raise RuntimeError("Unknown job '%s'." % job)
+
+
+def parse_job_args(parse_inputs, parser, args):
+    """
+    Call `parse_inputs(parser, args)` turning the
+    exit of argparse on invalid arguments into an error.
+    """
+    usage = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(usage):
+            return parse_inputs(parser, args)
+    except SystemExit:
+        raise RuntimeError("Invalid arguments %s:\n%s" % (args, usage.getvalue()))
+
+
+#########################
+# Server
+#########################
+
+class JobServer(object):
+    """
+    Accept jobs on the Unix socket `socket_path` and
+    run them in a pool of `workers` processes.
+    """
+    def __init__(self, socket_path, workers=None, cache_size=DEFAULT_CACHE_SIZE):
+        self.socket_path = socket_path
+        self.pool = ProcessPoolExecutor(max_workers=workers,
+                                        initializer=_init_worker,
+                                        initargs=(cache_size,))
+        self._stop = None
+
+    async def handle_connection(self, reader, writer):
+        try:
+            request = json.loads(await reader.readline())
+            if request["job"] == "shutdown":
+                reply = {"status": "ok", "result": None}
+                self._stop.set()
+            else:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(
+                    self.pool, run_job, request["job"], request["args"], request["cwd"])
+                reply = {"status": "ok", "result": result}
+        except (Exception, SystemExit):
+            reply = {"status": "error", "message": traceback.format_exc()}
+        writer.write(json.dumps(reply).encode() + b"\n")
+        await writer.drain()
+        writer.close()
+
+    async def serve(self):
+        self._stop = asyncio.Event()
+        server = await asyncio.start_unix_server(self.handle_connection,
+                                                 path=self.socket_path,
+                                                 limit=_LINE_LIMIT)
+        async with server:
+            await self._stop.wait()
+
+    def run(self):
+        remove_stale_socket(self.socket_path)
+        try:
+            asyncio.run(self.serve())
+        finally:
+            self.pool.shutdown()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+def remove_stale_socket(socket_path):
+    """
+    Remove a socket file left behind by a server that
+    is no longer running. Refuse to start if one is.
+    """
+    if not os.path.exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(socket_path)
+            return
+    raise RuntimeError("A job server is already listening on %s" % socket_path)
+
+
+#############################################################################
+# Commandline argument parser and main function
+#############################################################################
+
+def argparser():
+    parser = argparse.ArgumentParser(
+            description="Run a local job server for vcf_features and anonymise_fastq.")
+    parser.add_argument("--socket", metavar="PATH",
+                        type=str,
+                        default=DEFAULT_SOCKET,
+                        help="Unix socket to listen on. Default: %s" % DEFAULT_SOCKET)
+    parser.add_argument("--workers", metavar="N",
+                        type=int,
+                        default=None,
+                        help="Number of worker processes. Default: number of CPUs")
+    parser.add_argument("--cache_size", metavar="N",
+                        type=int,
+                        default=DEFAULT_CACHE_SIZE,
+                        help="Number of BED files whose interval trees are kept "
+                             "in each worker. Default: %i" % DEFAULT_CACHE_SIZE)
+    parser.add_argument("--shutdown",
+                        action="store_true",
+                        help="Stop the server listening on --socket and exit.")
+    return parser
+
+
+def main():
+    user_inputs = argparser().parse_args()
+    if user_inputs.shutdown:
+        submit_job(user_inputs.socket, "shutdown", [])
+        return 0
+    JobServer(user_inputs.socket,
+              workers=user_inputs.workers,
+              cache_size=user_inputs.cache_size).run()
+    return 0
+
+
+if __name__ == "__main__":
+    main()
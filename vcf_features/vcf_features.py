@@ -1,48 +1,129 @@
 
 import pandas as pd
+import numpy as np
 
 import intervaltree
 
 import csv 
 import gzip
 import os
+import re
 
 
 
 
-def gene_variants(df_vcf, chrom_interval_tree):
+def sample_columns(df_vcf):
     """
-    #!!! documentation. 
+    Return the names of the sample columns of `df_vcf`, 
+    i.e. every column after FORMAT (VCF columns 10 onwards). 
+    Without a FORMAT column the last column is taken 
+    to be the only sample. 
     """
-    sample_name = df_vcf.columns[-1] #!!! Need to make this more general / robust
-    gene_variant_record = {}
+    columns = list(df_vcf.columns)
+    if "FORMAT" in columns:
+        return columns[columns.index("FORMAT") + 1:]
+    return columns[-1:]
+
+
+def assign_genes(df_vcf, chrom_interval_tree):
+    """
+    Query the interval tree once for every variant in `df_vcf`. 
+    Returns 
+      - a DataFrame with one row per (variant, gene) pair, 
+        with columns "variant" (row position in `df_vcf`), "gene", 
+        and the CHROM, POS, REF and ALT of the variant, 
+      - the row positions of variants on chromosomes absent from the tree, 
+      - the row positions of variants not intersecting any interval. 
+    """
+    variant_rows = []
+    genes = []
     no_chrom = []
     no_intersections = []
-    
-    for index, variant in df_vcf.iterrows():
-        chrom = variant[0]        
+    for row, (chrom, pos) in enumerate(zip(df_vcf.iloc[:, 0], df_vcf["POS"])):
         if chrom not in chrom_interval_tree:
-            no_chrom.append(index)
-            #print("Chromosome %s not in supplied gene list. \nCurrent variant: \n%s" % (chrom, variant))
+            no_chrom.append(row)
             continue
-        
-        intersections = chrom_interval_tree[chrom][variant["POS"]]
-        if not intersections: # no intersections
-            no_intersections.append(index)
-            #print("Variant not contained in genes provided.\nCurrent variant: \n%s" % variant)
+        intersections = chrom_interval_tree[chrom][pos]
+        if not intersections:
+            no_intersections.append(row)
             continue
-            
         for interval in intersections:
-            gene_name = interval.data
-            if gene_name not in gene_variant_record:
-                gene_variant_record[gene_name] = []
-            #genotype = get_genotype(variant[sample_name], fmt=variant["FORMAT"])
-            gene_variant_record[gene_name].append(variant)
-    return gene_variant_record, df_vcf.iloc[no_chrom, :], df_vcf.iloc[no_intersections, :] #!!! need deep copy?
-        
+            variant_rows.append(row)
+            genes.append(interval.data)
+    variant_rows = np.array(variant_rows, dtype=int)
+    df_assignment = pd.DataFrame({"variant" : variant_rows, 
+                                  "gene"    : genes, 
+                                  "CHROM"   : df_vcf.iloc[:, 0].values[variant_rows], 
+                                  "POS"     : df_vcf["POS"].values[variant_rows]}, 
+                                 columns=["variant", "gene", "CHROM", "POS"])
+    for column in ["REF", "ALT"]:
+        if column in df_vcf.columns:
+            df_assignment[column] = df_vcf[column].values[variant_rows]
+    return df_assignment, no_chrom, no_intersections
+
+
+# An allele that differs from the reference: 
+# an integer > 0 at the start of the genotype or after a '/' or '|'. 
+ALT_ALLELE_PATTERN = r"(?:^|[/|])0*[1-9]"
+
+_alt_allele_regex = re.compile(ALT_ALLELE_PATTERN)
+
 
+def alt_allele_counts(df_vcf, samples, rows=None):
+    """
+    Return an integer matrix of shape (number of rows, number of samples) 
+    counting, for each variant in the row positions `rows` of `df_vcf` 
+    (default: all rows) and each sample, the alleles in the 
+    genotype (GT) that differ from the reference. 
+    Missing alleles ('.') are not counted. 
+    """
+    if rows is None:
+        rows = np.arange(df_vcf.shape[0])
+    counts = np.zeros((len(rows), len(samples)), dtype=int)
+    if len(rows) == 0:
+        return counts
+    df_rows = df_vcf.iloc[rows]
+    if "FORMAT" in df_vcf.columns:
+        formats = df_rows["FORMAT"].astype(str).values
+    else:
+        formats = np.full(len(rows), '', dtype=object)
+    gt_index = np.array([genotype_index(fmt) for fmt in formats])
+
+    findall = _alt_allele_regex.findall
+    for k in np.unique(gt_index):
+        block_rows = np.flatnonzero(gt_index == k)
+        for j, sample in enumerate(samples):
+            values = df_rows[sample].values[block_rows]
+            if k == 0:
+                genotypes = [str(value).split(':', 1)[0] for value in values]
+            else:
+                genotypes = [_field(str(value), k) for value in values]
+            counts[block_rows, j] = [len(findall(genotype)) for genotype in genotypes]
+    return counts
 
 
+def _field(sample_string, k):
+    """
+    The `k`-th ':' separated field of `sample_string`, 
+    or '' if it has fewer fields. 
+    """
+    fields = sample_string.split(':', k + 1)
+    return fields[k] if k < len(fields) else ''
+
+
+def gene_load(df_vcf, df_assignment, samples):
+    """
+    Compute the mutation load of every gene for every sample 
+    in `df_vcf`, given the variant to gene assignment 
+    `df_assignment` computed by `assign_genes`. 
+    Alleles are only counted for the variants assigned to a gene. 
+    Returns a (samples x genes) DataFrame. 
+    """
+    variants = df_assignment["variant"].values
+    rows = np.unique(variants)
+    counts = alt_allele_counts(df_vcf, samples, rows)
+    df_pair_counts = pd.DataFrame(counts[np.searchsorted(rows, variants)], columns=samples)
+    return df_pair_counts.groupby(df_assignment["gene"].values).sum().T
 
 
 ## Utilities
@@ -52,15 +133,20 @@ def get_genotype(sample_string, fmt=''):
     """
     #!!! Docs!
     """
+    return sample_string.split(':')[genotype_index(fmt)]
+
+def genotype_index(fmt=''):
+    """
+    Position of the GT field in the FORMAT string `fmt`. 
+    An empty `fmt` is taken to mean GT only. 
+    """
     if not fmt:
-        gt_index = 0
+        return 0
+    fields = fmt.split(':')
+    if "GT" in fields:
+        return fields.index("GT")
     else:
-        fields = fmt.split(':')
-        if "GT" in fields:
-            gt_index = fields.index("GT")
-        else:
-            raise RuntimeError("No genotype tag detected.")
-    return sample_string.split(':')[gt_index]
+        raise RuntimeError("No genotype tag detected.")
 
 ############
 def num_header_row(vcfpath):
@@ -84,6 +170,19 @@ def vcf_to_df(vcfpath):
     #!!! Docs!
     """
     # num = num_header_row(vcfpath)
+    header, names = read_vcf_header(vcfpath)
+    df_vcf = pd.read_csv(open_handler(vcfpath, "rt"), 
+                         skiprows=len(header), 
+                         sep='\t', 
+                         names=names, 
+                         dtype={names[0] : str})
+    return header, df_vcf
+
+def read_vcf_header(vcfpath):
+    """
+    Return the header rows (starting with '#') of a VCF 
+    file and the column names given by the last of them. 
+    """
     with open_handler(vcfpath, 'rt') as infile:
         header = []
         n_header = 0
@@ -97,12 +196,36 @@ def vcf_to_df(vcfpath):
         
         if '\t' in header[-1]: 
             names = header[-1].split('\t')
-        
-    df_vcf = pd.read_csv(open_handler(vcfpath, "rt"), 
-                         skiprows=n_header, 
-                         sep='\t', 
-                         names=names)
-    return header, df_vcf
+    return header, names
+
+def vcf_chunks(vcfpath, budget):
+    """
+    Read the VCF file in chunks of rows whose sizes are 
+    chosen by `budget` (a `mgha_common.memory.MemoryBudget`), 
+    yielding DataFrames indexed by row number in the file. 
+    The memory used by each chunk is reported back 
+    to `budget` to size the following chunks. 
+    A VCF without variants yields a single empty DataFrame. 
+    """
+    header, names = read_vcf_header(vcfpath)
+    with open_handler(vcfpath, 'rt') as infile:
+        reader = pd.read_csv(infile, 
+                             skiprows=len(header), 
+                             sep='\t', 
+                             names=names, 
+                             dtype={names[0] : str}, 
+                             iterator=True)
+        n_chunk = 0
+        while True:
+            try:
+                df_chunk = reader.get_chunk(budget.next_chunk_size())
+            except StopIteration:
+                break
+            budget.observe(df_chunk.shape[0], df_chunk.memory_usage(deep=True).sum())
+            n_chunk += 1
+            yield df_chunk
+    if n_chunk == 0:
+        yield pd.DataFrame(columns=names)
 
 def bed_to_df(bedfilepath, header=None):
     """